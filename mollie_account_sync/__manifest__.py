@@ -10,13 +10,16 @@
     'license': 'LGPL-3',
     'category': '',
     'depends': [
-        'account_accountant'
+        'account_accountant',
+        'payment_mollie_official'
     ],
     'data': [
+        'security/ir.model.access.csv',
         'views/account_journal.xml',
         'views/bank_statement.xml',
         'views/templates.xml',
-        'wizard/mollie_init_views.xml'
+        'wizard/mollie_init_views.xml',
+        'data/ir_cron_data.xml'
     ],
     "qweb": ['static/src/xml/*.xml'],
 }
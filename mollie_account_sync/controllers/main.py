@@ -3,10 +3,18 @@ import json
 from odoo import http, tools
 from odoo.http import request
 
+ORDER_BATCH_LIMIT = 200
+
 
 class MollieData(http.Controller):
 
     @http.route('/get_mollie_order_info', type='json', auth='user')
     def get_order_info(self, order_id, journal_id):
         AccountJournal = request.env["account.journal"]
-        return AccountJournal.browse(journal_id)._api_call_get_order_meta(order_id)
\ No newline at end of file
+        return AccountJournal.browse(journal_id)._api_call_get_order_meta(order_id)
+
+    @http.route('/get_mollie_orders_info', type='json', auth='user')
+    def get_orders_info(self, order_ids, journal_id):
+        """ Metadata of many orders at once, used to preload the info of a whole statement """
+        AccountJournal = request.env["account.journal"]
+        return AccountJournal.browse(journal_id)._api_get_orders_meta(order_ids[:ORDER_BATCH_LIMIT], raise_exception=False)
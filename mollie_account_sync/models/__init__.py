@@ -1,3 +1,5 @@
 # -*- coding: utf-8 -*-
 
 from . import account_journal
+from . import account_payment
+from . import mollie_settlement_cache
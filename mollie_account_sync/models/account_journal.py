@@ -1,18 +1,251 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import itertools
 import json
 import logging
+import queue
+import random
 import requests
-from datetime import datetime
-
-from odoo import _, api, fields, models
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from odoo import SUPERUSER_ID, _, api, fields, models
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools import split_every
+
+from odoo.addons.payment_mollie_official.models.mollie_api_metric import (
+    MollieMetricTags, mollie_api_caller, mollie_api_current_caller, mollie_logical_endpoint, mollie_record_call)
+from odoo.addons.payment_mollie_official.models.mollie_records import (
+    decode_mollie_payments, decode_mollie_refunds, mollie_payment_ref, parse_mollie_datetime)
+from .mollie_settlement_cache import CACHE_ENTRY_MAX_SIZE, RecordsCompressor
 
 
 _logger = logging.getLogger(__name__)
 
-TIMEOUT = 20
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+MAX_RETRIES = 4
+BACKOFF_FACTOR = 0.5
+MAX_BACKOFF = 30
+RETRY_STATUS = (429, 500, 502, 503, 504)
 API_DEBUG = False
+FETCH_CONCURRENCY = 4
+POOL_SIZE = 10
+ACCOUNT_CONCURRENCY = 4
+JOURNAL_SYNC_WORKERS = 4
+ROUNDING_LIMIT = Decimal('0.05')
+SETTLEMENT_PAGE_SIZE = 40
+SETTLEMENT_FINAL_STATUS = ('paidout', 'failed')
+RECHECK_CHUNK_SIZE = 20
+STATEMENT_LINE_CHUNK_SIZE = 500
+STREAM_QUEUE_PAGES = 4
+_STREAM_END = object()
+
+_sessions = {}
+_account_semaphores = {}
+_sessions_lock = threading.Lock()
+
+_prefetch_executor = None
+_prefetching = set()
+_prefetch_lock = threading.Lock()
+
+ORDER_META_TTL = 10 * 60
+ORDER_META_CACHE_SIZE = 5000
+_order_meta_cache = OrderedDict()
+_order_meta_lock = threading.Lock()
+
+
+def _mollie_get_session(api_key):
+    """ One pooled session per api key and worker so the connection is kept alive
+        between the calls (e.g. pages of a settlement) and between the syncs.
+    """
+    key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+    with _sessions_lock:
+        session = _sessions.get(key_hash)
+        if not session:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount('https://', adapter)
+            session.headers.update({
+                'content-type': 'application/json',
+                'Accept-Encoding': 'gzip, deflate',
+                'Authorization': api_key
+            })
+            _sessions[key_hash] = session
+    return session
+
+
+def _mollie_get_account_semaphore(api_key):
+    """ Limit the concurrent calls made with an api key, journals of the same mollie
+        account synced at the same time share it.
+    """
+    key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+    with _sessions_lock:
+        if key_hash not in _account_semaphores:
+            _account_semaphores[key_hash] = threading.BoundedSemaphore(ACCOUNT_CONCURRENCY)
+        return _account_semaphores[key_hash]
+
+
+def _mollie_retry_delay(attempt, response=None):
+    """ Jittered exponential backoff, mollie's Retry-After header is used when given """
+    if response is not None and response.headers.get('Retry-After'):
+        try:
+            return min(float(response.headers['Retry-After']), MAX_BACKOFF)
+        except ValueError:
+            pass    # HTTP date is not used by mollie
+    return random.uniform(0, min(BACKOFF_FACTOR * (2 ** attempt), MAX_BACKOFF))
+
+
+def _mollie_fetch(api_endpoint, api_key, metric_tags=None):
+    """ Call mollie api. It does not use the ORM so it can be called from a thread.
+        Transient errors (connection issues, 5xx and 429) are retried with backoff.
+
+        :param api_endpoint: full url of the api endpoint
+        :param api_key: authorization header value
+        :param metric_tags: `MollieMetricTags` the call is counted with
+    """
+    session = _mollie_get_session(api_key)
+    semaphore = _mollie_get_account_semaphore(api_key)
+    _logger.info('Mollie SYNC CALL on: %s', api_endpoint)
+    start = time.monotonic()
+    attempt = 0
+    size = 0
+    success = False
+    try:
+        while True:
+            response = None
+            try:
+                with semaphore:
+                    response = session.get(api_endpoint, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    size = len(response.content)
+                    data = response.json()
+                    success = True
+                    return data
+                error = 'HTTP %s' % response.status_code
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            except requests.exceptions.HTTPError as e:
+                _logger.error('Mollie SYNC issue: %s', e)
+                raise UserError(_('Some thing went wrong please try again after some time.'))
+
+            if attempt >= MAX_RETRIES:
+                _logger.error('Mollie SYNC issue: %s (after %s retries)', error, attempt)
+                raise UserError(_('Some thing went wrong please try again after some time.'))
+            delay = _mollie_retry_delay(attempt, response)
+            _logger.warning('Mollie SYNC issue: %s, retry in %.1f seconds', error, delay)
+            time.sleep(delay)
+            attempt += 1
+    finally:
+        mollie_record_call(metric_tags, mollie_logical_endpoint('GET', api_endpoint), time.monotonic() - start,
+                           size=size, error=not success, retries=attempt)
+
+
+def _mollie_iter_pages(api_endpoint, api_key, resource, metric_tags=None):
+    """ Follow the pages of a mollie list endpoint.
+
+        :param resource: name of the embedded records (e.g. payments, refunds)
+        :return: generator of list of records, one per page
+    """
+    while api_endpoint:
+        data = _mollie_fetch(api_endpoint, api_key, metric_tags)
+        if data and data['count'] > 0:
+            yield data['_embedded'][resource]
+        api_endpoint = data['_links'].get('next') and data['_links']['next']['href']
+
+
+def _mollie_fetch_list(api_endpoint, api_key, resource, metric_tags=None):
+    """ :return: list of records of all the pages of a mollie list endpoint """
+    return [record for page in _mollie_iter_pages(api_endpoint, api_key, resource, metric_tags) for record in page]
+
+
+class MollieListStream(object):
+    """ Records of a mollie list endpoint fetched by a worker thread. Pages are passed
+        through a bounded queue so the worker waits when the reader is behind: only
+        a few pages are in memory whatever the number of records.
+    """
+
+    def __init__(self, executor, api_endpoint, api_key, resource, metric_tags=None):
+        self._queue = queue.Queue(maxsize=STREAM_QUEUE_PAGES)
+        self._cancelled = threading.Event()
+        self._future = executor.submit(self._produce, api_endpoint, api_key, resource, metric_tags)
+
+    def _put(self, item):
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, api_endpoint, api_key, resource, metric_tags):
+        try:
+            for page in _mollie_iter_pages(api_endpoint, api_key, resource, metric_tags):
+                if not self._put(page):
+                    return
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(_STREAM_END)
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield from item
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._future.cancel()
+
+
+def _mollie_prefetch_list(api_endpoint, api_key, resource, metric_tags=None):
+    """ Fetch the records of a mollie list endpoint, compressed page by page so a prefetched
+        settlement takes the size of its cache entry in memory.
+
+        :return: records compressed with `RecordsCompressor`, None if they are too big to be
+                 cached (they are streamed by the import instead)
+    """
+    compressor = RecordsCompressor(CACHE_ENTRY_MAX_SIZE)
+    for page in _mollie_iter_pages(api_endpoint, api_key, resource, metric_tags):
+        for record in page:
+            compressor.add(record)
+        if compressor.overflow:
+            _logger.info('Mollie SYNC: %s is too big to be prefetched', api_endpoint)
+            return None
+    return compressor.getvalue()
+
+
+def _mollie_prefetch_settlement(endpoint, api_key, metric_tags=None):
+    """ Fetch a settlement with its payments and refunds, ready for the settlement cache.
+
+        :param endpoint: url of the settlement
+        :return: tuple of (settlement, compressed payments, compressed refunds), None if
+                 the settlement is not paid out yet or too big to be prefetched
+    """
+    settlement = _mollie_fetch(endpoint, api_key, metric_tags)
+    if settlement['status'] != 'paidout':
+        return None
+    payments_data = _mollie_prefetch_list(endpoint + '/payments', api_key, 'payments', metric_tags)
+    if payments_data is None:
+        return None
+    refunds_data = _mollie_prefetch_list(endpoint + '/refunds', api_key, 'refunds', metric_tags)
+    if refunds_data is None:
+        return None
+    return settlement, payments_data, refunds_data
 
 
 class AccountJournal(models.Model):
@@ -22,18 +255,27 @@ class AccountJournal(models.Model):
     mollie_api_key = fields.Char()
     mollie_test = fields.Boolean()
     mollie_last_sync = fields.Datetime()
+    mollie_auto_sync = fields.Boolean(string="Automatic Sync", help="Import new paid out settlements every day")
+    mollie_recheck_statement_id = fields.Many2one('account.bank.statement', copy=False, help="Last statement processed by Fix Old Statements")
+    mollie_last_settlement_id = fields.Char(string="Last Synced Settlement", copy=False, help="Only newer settlements are fetched by automatic sync")
     mollie_init_done = fields.Boolean()
     mollie_transfer_id = fields.Many2one('account.journal')
     need_transfer_count = fields.Integer(compute='_compute_transfer_count')
 
     def _compute_transfer_count(self):
+        """ Counted for all the journals of the dashboard with one grouped query """
+        mollie_journals = self.filtered(lambda j: j.bank_statements_source == 'mollie_sync')
+        transfer_counts = {}
+        if mollie_journals._origin:
+            groups = self.env['account.payment'].read_group([
+                ('payment_type', '=', 'transfer'),
+                ('journal_id', 'in', mollie_journals._origin.ids),
+                ('state', '=', 'draft')
+            ], ['journal_id'], ['journal_id'])
+            transfer_counts = {group['journal_id'][0]: group['journal_id_count'] for group in groups}
         for journal in self:
-            if journal.bank_statements_source == 'mollie_sync':
-                journal.need_transfer_count = self.env['account.payment'].search_count([
-                    ('payment_type', '=', 'transfer'),
-                    ('journal_id', '=', journal.id),
-                    ('state', '=', 'draft')
-                ])
+            if journal in mollie_journals:
+                journal.need_transfer_count = transfer_counts.get(journal._origin.id, 0)
             else:
                 journal.need_transfer_count = 0
 
@@ -55,8 +297,8 @@ class AccountJournal(models.Model):
 
         # Just For testing account (This is not based on test account)
         if self.mollie_test and API_DEBUG:
-            payment_data = self._mollie_api_call('https://api.mollie.com/v2/payments?limit=3')['_embedded']['payments']
-            refund_data = self._mollie_api_call('https://api.mollie.com/v2/refunds?limit=1')['_embedded']['refunds']
+            payment_data = self._mollie_api_call(self._mollie_get_api_url('payments?limit=3'))['_embedded']['payments']
+            refund_data = self._mollie_api_call(self._mollie_get_api_url('refunds?limit=1'))['_embedded']['refunds']
             settlement = {
                 'reference': "TEST 123123",
                 'createdAt': "2020-02-29T04:30:00+00:00"
@@ -95,6 +337,7 @@ class AccountJournal(models.Model):
             ],
         }
 
+    @mollie_api_caller('settlement_import')
     def _process_settlements(self, settlements_data):
         """ Process settlements data received from mollie API.
             - This method fetch the payment and refund information for settlement.
@@ -102,79 +345,162 @@ class AccountJournal(models.Model):
             - It does not proccess it settlement is already synced.
 
             :param settlements_data: list of settlements data received from mollie API
+            :return: dict with number of imported and skipped settlements
         """
         if settlements_data['count'] == 0:
-            return
-        settlements_data['_embedded']['settlements'].reverse()
+            return {'imported': 0, 'skipped': 0}
+        # Oldest first, the list of the caller is left as it is
+        settlements = settlements_data['_embedded']['settlements'][::-1]
         BankStatement = self.env['account.bank.statement']
-        for settlement in settlements_data['_embedded']['settlements']:
+        settlement_ids = [settlement['id'] for settlement in settlements]
+        existing_settlement_ids = set(BankStatement.search([('mollie_settlement_id', 'in', settlement_ids)]).mapped('mollie_settlement_id'))
+        settlements_to_sync = []
+        for settlement in settlements:
             # TODO: Manage chargeback
-            exist = BankStatement.search([('mollie_settlement_id', '=', settlement['id'])], limit=1)
-            if exist:
+            if settlement['id'] in existing_settlement_ids:
                 continue
             if settlement['status'] != 'paidout':
                 continue
-            payment_data = self._api_get_settlement_payments(settlement['id'])
-            refund_data = self._api_get_settlement_refunds(settlement['id'])
+            settlements_to_sync.append(settlement)
+
+        # Statements are created on main cursor while next settlements are downloaded
+        for settlement, payment_data, refund_data in self._api_iter_settlements_details(settlements_to_sync):
             self._create_bank_statements(payment_data, refund_data, settlement)
+        return {
+            'imported': len(settlements_to_sync),
+            'skipped': settlements_data['count'] - len(settlements_to_sync),
+        }
+
+    @api.model
+    def _cron_sync_mollie_settlements(self):
+        journals = self.search([
+            ('bank_statements_source', '=', 'mollie_sync'),
+            ('mollie_auto_sync', '=', True),
+            ('mollie_api_key', '!=', False),
+            ('mollie_test', '=', False)
+        ])
+        for journal_id, result in journals._mollie_sync_journals().items():
+            _logger.info('Mollie SYNC of journal %s: %s', journal_id, result)
+
+    def action_sync_mollie_journals(self):
+        """ Import new settlements of all the selected mollie journals at once """
+        journals = self.filtered(lambda j: j.bank_statements_source == 'mollie_sync' and j.mollie_api_key and not j.mollie_test)
+        if not journals:
+            raise UserError(_('Please select mollie journals with an API key.'))
+        results = journals._mollie_sync_journals()
+        messages = []
+        for journal in journals:
+            result = results[journal.id]
+            if 'error' in result:
+                messages.append(_('%s: failed (%s)') % (journal.name, result['error']))
+            else:
+                messages.append(_('%s: %s imported, %s skipped') % (journal.name, result['imported'], result['skipped']))
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Mollie Sync'),
+                'message': ' | '.join(messages),
+                'type': 'warning' if any('error' in result for result in results.values()) else 'success',
+                'sticky': True,
+            }
+        }
+
+    def _mollie_sync_journals(self):
+        """ Import new settlements of journals concurrently. Every journal is synced in its
+            own thread with its own cursor, so a failing journal is rolled back alone.
+
+            :return: dict of journal id and result (imported and skipped counts, or error)
+        """
+        def error_message(e):
+            return e.name if isinstance(e, UserError) else str(e)
+
+        results = {}
+        # Threads can only use the cursor of a test once the registry is in test mode
+        testing = getattr(threading.current_thread(), 'testing', False)
+        if len(self) <= 1 or (testing and not self.pool.test_cr):
+            for journal in self:
+                try:
+                    with self.env.cr.savepoint():
+                        results[journal.id] = journal._mollie_sync_new_settlements()
+                except Exception as e:
+                    _logger.exception('Mollie SYNC failed for journal %s', journal.name)
+                    results[journal.id] = {'error': error_message(e)}
+            return results
+
+        uid, context = self.env.uid, self.env.context
+
+        def sync_journal(journal_id):
+            with api.Environment.manage(), self.pool.cursor() as cr:
+                journal = api.Environment(cr, uid, context)['account.journal'].browse(journal_id)
+                try:
+                    return journal._mollie_sync_new_settlements()
+                except Exception as e:
+                    cr.rollback()
+                    _logger.exception('Mollie SYNC failed for journal %s', journal_id)
+                    return {'error': error_message(e)}
+
+        with ThreadPoolExecutor(max_workers=min(JOURNAL_SYNC_WORKERS, len(self))) as executor:
+            for journal_id, result in zip(self.ids, executor.map(sync_journal, self.ids)):
+                results[journal_id] = result
+        return results
+
+    @mollie_api_caller('settlement_sync')
+    def _mollie_sync_new_settlements(self):
+        """ Import the settlements created after the last synced settlement (cursor). The first
+            sync only looks at the latest settlements which are newer than the last statement.
+
+            :return: dict with number of imported and skipped settlements
+        """
+        self.ensure_one()
+        settlements = self._api_get_settlements_since(self.mollie_last_settlement_id)
+        if not settlements:
+            self.mollie_last_sync = fields.Datetime.now()
+            return {'imported': 0, 'skipped': 0}
+
+        settlements_to_sync = settlements
+        if not self.mollie_last_settlement_id:
+            last_bnk_stmt = self.env['account.bank.statement'].search([('journal_id', '=', self.id)], limit=1)
+            if last_bnk_stmt:
+                settlements_to_sync = [s for s in settlements if fields.Date.to_date(self._format_mollie_date(s['createdAt'])) > last_bnk_stmt.date]
+        result = self._process_settlements({
+            'count': len(settlements_to_sync),
+            '_embedded': {'settlements': settlements_to_sync}
+        })
+        result['skipped'] += len(settlements) - len(settlements_to_sync)
+
+        # Move cursor up to the newest settlement that will not change anymore
+        last_settlement_id = self.mollie_last_settlement_id
+        for settlement in reversed(settlements):
+            if settlement['status'] not in SETTLEMENT_FINAL_STATUS:
+                break
+            last_settlement_id = settlement['id']
+        self.write({
+            'mollie_last_settlement_id': last_settlement_id,
+            'mollie_last_sync': fields.Datetime.now()
+        })
+        return result
 
     def _create_bank_statements(self, payment_data, refund_data, settlement_data, return_lines=False):
         """ Create new bank statement based on settlement, settlement payments and settlement refunds.
 
             This method also try to guess the partner for statement.
+            Lines are prepared and created by chunks while payments and refunds are read, so
+            big settlements are imported without having all their lines in memory.
 
-            :param payment_data: list of payments data for given settlement.
-            :param refund_data: list of refund data for given settlement.
+            :param payment_data: iterable of payments data for given settlement.
+            :param refund_data: iterable of refund data for given settlement.
             :param settlement_data: settlement information.
         """
-        mollie_acquirer = self.env.ref('payment_mollie_official.payment_acquirer_mollie')
         BankStatement = self.env['account.bank.statement']
-        statement_lines = []
-        for payment in payment_data:
-            if not payment.get('settlementAmount'):
-                continue
-            json_info = {}
-            statement_line = {
-                'date': self._format_mollie_date(payment['createdAt']),
-                'name': self._generate_payment_ref(payment['metadata']) or payment['description'],
-                'ref': payment['description'],
-                'amount': float(payment['settlementAmount']['value']),
-                'mollie_transaction_id': payment['id'],
-
-            }
-            if payment.get('metadata'):
-                json_info.update(payment['metadata'])
-            if payment.get('orderId'):
-                json_info['mollie_order_id'] = payment.get('orderId')
-            if len(json_info.keys()):
-                statement_line['mollie_json_info'] = json.dumps(json_info)
-
-            transaction = self.env['payment.transaction'].search([('acquirer_reference', '=', payment['id']), ('acquirer_id', '=', mollie_acquirer.id)], limit=1)
-            if transaction and transaction.partner_id:
-                statement_line['partner_id'] = transaction.partner_id.id
-            statement_lines.append((0, 0, statement_line))
-        for refund in refund_data:
-            if not refund.get('settlementAmount'):
-                continue
-            statement_line = {
-                'date': self._format_mollie_date(refund['createdAt']),
-                'name': self._generate_payment_ref(refund['metadata']) or refund['description'],
-                'ref': refund['description'],
-                'amount': float(refund['settlementAmount']['value']),
-                'mollie_transaction_id': refund['id'],
-            }
-            statement_lines.append((0, 0, statement_line))
-        for fee_line in self.get_payment_fees_lines(settlement_data)['lines']:
-            statement_lines.append((0, 0, fee_line))
-
         statement_vals = {
             'name': settlement_data['reference'],
             'date': self._format_mollie_date(settlement_data['createdAt']),
             'journal_id': self.id,
-            'line_ids': statement_lines,
             'balance_start': self.env["account.bank.statement"]._get_opening_balance(self.id),
             'mollie_settlement_id': settlement_data['id'],
         }
+        lines_vals = self._mollie_iter_statement_lines(payment_data, refund_data, settlement_data)
 
         if self.mollie_transfer_id:
             manual_method = self.outbound_payment_method_ids.filtered(lambda m: m.code == 'manual')
@@ -182,12 +508,12 @@ class AccountJournal(models.Model):
                 raise UserError(_('Please enable Outgoing Payments mehtod "Manual" for this journal.'))
             manual_method = manual_method[0]
 
-            statement_lines.append((0, 0, {
+            lines_vals = itertools.chain(lines_vals, [{
                 'date': self._format_mollie_date(settlement_data['createdAt']),
                 'name': 'MOLLIE PAYMENTS REF %s (for Internal Transfer)' % (settlement_data['reference']),
                 'ref': 'MOLLIE PAYMENTS REF %s' % (settlement_data['reference']),
                 'amount': - float(settlement_data['amount']['value']),
-            }))
+            }])
 
             transfer_id = self.env['account.payment'].create({
                 'name': 'Internal Transfer Mollie ref: %s' % (settlement_data['reference']),
@@ -200,90 +526,179 @@ class AccountJournal(models.Model):
             })
             statement_vals['mollie_internal_transfer_id'] = transfer_id.id
         if return_lines:
+            statement_vals['line_ids'] = [(0, 0, line_vals) for line_vals in lines_vals]
             return statement_vals
+
         statement = BankStatement.create(statement_vals)
-        statement.balance_end_real = statement.balance_end
+        StatementLine = self.env['account.bank.statement.line']
+        lines_total = Decimal(0)
+        for chunk in split_every(STATEMENT_LINE_CHUNK_SIZE, lines_vals, list):
+            for line_vals in chunk:
+                line_vals['statement_id'] = statement.id
+                lines_total += Decimal(str(line_vals['amount']))
+            StatementLine.create(chunk)
+            # Do not keep all the created lines in cache
+            StatementLine.flush()
+            StatementLine.invalidate_cache()
+
+        # FIX Rounding issues, balance is written only once all lines are created
+        rounding_line, lines_total = self._mollie_compute_rounding(lines_total, statement_vals['date'])
+        if rounding_line:
+            StatementLine.create(dict(rounding_line, statement_id=statement.id))
+        statement.balance_end_real = float(Decimal(str(statement_vals['balance_start'])) + lines_total)
+        return statement
+
+    def _mollie_iter_statement_lines(self, payment_data, refund_data, settlement_data):
+        """ :return: generator of statement line values of payments, refunds and fees of settlement """
+        PaymentTransaction = self.env['payment.transaction']
+        for payments in split_every(STATEMENT_LINE_CHUNK_SIZE, decode_mollie_payments(payment_data), list):
+            references = set()
+            for payment in payments:
+                references.add(payment.id)
+                if payment.order_id:
+                    references.add(payment.order_id)
+            transactions = PaymentTransaction._mollie_get_tx_from_references(references)
+            for payment in payments:
+                if payment.settlement_amount is None:
+                    continue
+                statement_line = {
+                    'date': payment.created_at.date(),
+                    'name': payment.reference or payment.description,
+                    'ref': payment.description,
+                    'amount': float(payment.settlement_amount),
+                    'mollie_transaction_id': payment.id,
+                }
+                json_info = dict(payment.metadata or {})
+                if payment.order_id:
+                    json_info['mollie_order_id'] = payment.order_id
+                if json_info:
+                    statement_line['mollie_json_info'] = json.dumps(json_info)
+
+                transaction = transactions.get(payment.id) or transactions.get(payment.order_id) or PaymentTransaction
+                transaction = transaction[:1]
+                if transaction and transaction.partner_id:
+                    statement_line['partner_id'] = transaction.partner_id.id
+                yield statement_line
+        for refund in decode_mollie_refunds(refund_data):
+            if refund.settlement_amount is None:
+                continue
+            yield {
+                'date': refund.created_at.date(),
+                'name': refund.reference or refund.description,
+                'ref': refund.description,
+                'amount': float(refund.settlement_amount),
+                'mollie_transaction_id': refund.id,
+            }
+        yield from self.get_payment_fees_lines(settlement_data)['lines']
 
-        # FIX Rounding issues
-        diff = statement.balance_start - statement.balance_end_real
-        if diff >= -0.05 and diff <= 0.05 and diff != 0:
-            line_data = [(4, l.id, 0) for l in statement.line_ids]
-            last_line = statement.line_ids[-1]
-            line_data.append((0, 0, {
-                'date': last_line.date,
+    def _mollie_compute_rounding(self, lines_total, date):
+        """ Lines of a settlement should balance each other but mollie amounts can have
+            small rounding differences. Amounts are summed with decimals to get exact difference.
+
+            :param lines_total: Decimal sum of the statement lines amounts
+            :param date: date of the rounding line
+            :return: tuple of (rounding line values or False, total of lines including rounding line)
+        """
+        if lines_total and abs(lines_total) <= ROUNDING_LIMIT:
+            return {
+                'date': date,
                 'name': 'Mollie rounding difference',
                 'ref': 'Mollie rounding difference',
-                'amount': diff
-            }))
-            statement.line_ids = line_data
-            statement.balance_end_real = statement.balance_end
+                'amount': float(-lines_total)
+            }, Decimal(0)
+        return False, lines_total
 
+    @mollie_api_caller('recheck')
     def recheck_all_statements(self):
-        '''Just to migrate old data to new one'''
+        '''Just to migrate old data to new one
+
+            Statements are processed in date order and committed by chunks. The last processed
+            statement is saved on the journal so an interrupted run continues from there.
+        '''
+        self.ensure_one()
         settlements_data = self._api_get_settlements(limit=25)
         if settlements_data['count'] == 0:
             return []
         settlement_dict = {}
         for settlement in settlements_data['_embedded']['settlements']:
             settlement_dict[settlement['id']] = settlement
-        statements = self.env['account.bank.statement'].search([('journal_id', '=', self.id)]).sorted('date')
+
+        BankStatement = self.env['account.bank.statement']
+        statements = BankStatement.search([('journal_id', '=', self.id)], order='date, id')
         previous_statement_amount = 0
-        for stat in statements:
-            if stat.line_ids.filtered(lambda s: (s.name).startswith('Fees ')):
-                stat.balance_start = previous_statement_amount
-                stat.balance_end_real = stat.balance_end
+        checkpoint = self.mollie_recheck_statement_id
+        if checkpoint and checkpoint in statements:
+            statements = statements[list(statements).index(checkpoint) + 1:]
+            previous_statement_amount = checkpoint.balance_end_real
+
+        fee_groups = self.env['account.bank.statement.line'].read_group(
+            [('statement_id', 'in', statements.ids), ('name', '=like', 'Fees %')], ['statement_id'], ['statement_id'])
+        statements_with_fees = {group['statement_id'][0] for group in fee_groups}
+
+        # Remote data is fetched concurrently in the same order as statements are processed
+        settlements_to_fetch = [settlement_dict[stat.mollie_settlement_id] for stat in statements
+                                if stat.id not in statements_with_fees and stat.mollie_settlement_id in settlement_dict]
+        settlements_details = self._api_iter_settlements_details(settlements_to_fetch)
+
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        try:
+            for index, stat in enumerate(statements, 1):
+                if stat.id in statements_with_fees:
+                    stat.write({
+                        'balance_start': previous_statement_amount,
+                        'balance_end_real': previous_statement_amount + sum(stat.line_ids.mapped('amount')),
+                    })
+                elif stat.mollie_settlement_id in settlement_dict:
+                    settelement_data, payment_data, refund_data = next(settlements_details)
+                    self._mollie_recheck_statement(stat, payment_data, refund_data, settelement_data, previous_statement_amount)
+
                 previous_statement_amount = stat.balance_end_real
-                continue
-            settelement_data = settlement_dict.get(stat.mollie_settlement_id)
-            if settelement_data:
-                payment_data = self._api_get_settlement_payments(settelement_data['id'])
-                refund_data = self._api_get_settlement_refunds(settelement_data['id'])
-                mollie_transaction_ids = []
-                new_lines = []
-
-                # USD fix
-                usd_lines = []
-                for payment in payment_data:
-                    if payment.get('amount', {}).get('currency') == 'USD':
-                        usd_lines.append(payment['id'])
-
-                for line in self._create_bank_statements(payment_data, refund_data, settelement_data, return_lines=True).get('line_ids', []):
-                    if line[2].get('mollie_transaction_id') and line[2].get('mollie_transaction_id') not in usd_lines:
-                        mollie_transaction_ids.append(line[2]['mollie_transaction_id'])
-                    else:
-                        new_lines.append(line)
-
-                valid_lines = []
-                for s_line in stat.line_ids:
-                    if s_line.mollie_transaction_id and s_line.mollie_transaction_id not in mollie_transaction_ids:
-                        if s_line.state != 'confirm' and s_line.journal_entry_ids:
-                            s_line.button_cancel_reconciliation()
-                        s_line.unlink()
-                    else:
-                        valid_lines.append(s_line.id)
-
-                line_data = [(4, l, 0) for l in valid_lines]
-                line_data.extend(new_lines)
-                stat.line_ids = line_data
-                stat.balance_start = previous_statement_amount
-                stat.balance_end_real = stat.balance_end
-
-                # FIX Rounding issues
-                diff = stat.balance_start - stat.balance_end_real
-                if diff >= -0.05 and diff <= 0.05 and diff != 0:
-                    line_data = [(4, l, 0) for l in stat.line_ids.ids]
-                    last_line = stat.line_ids[-1]
-                    line_data.append((0, 0, {
-                        'date': last_line.date,
-                        'name': 'Mollie rounding difference',
-                        'ref': 'Mollie rounding difference',
-                        'amount': diff
-                    }))
-                    stat.line_ids = line_data
-                    stat.balance_start = previous_statement_amount
-                    stat.balance_end_real = stat.balance_end
-
-            previous_statement_amount = stat.balance_end_real
+                if index % RECHECK_CHUNK_SIZE == 0 or index == len(statements):
+                    self.mollie_recheck_statement_id = stat
+                    if auto_commit:
+                        self.env.cr.commit()
+            # Resumed once more so the last settlement is cached
+            next(settlements_details, None)
+        finally:
+            # Stops the fetch threads when a statement fails
+            settlements_details.close()
+        self.mollie_recheck_statement_id = False
+
+    def _mollie_recheck_statement(self, stat, payment_data, refund_data, settelement_data, balance_start):
+        """ Apply the difference between statement lines and mollie data on the statement:
+            lines unknown to mollie are removed and missing lines are created in one write.
+        """
+        payment_data = list(decode_mollie_payments(payment_data))
+        # USD fix
+        usd_lines = {payment.id for payment in payment_data if payment.currency == 'USD'}
+
+        mollie_transaction_ids = set()
+        new_lines = []
+        for line in self._create_bank_statements(payment_data, refund_data, settelement_data, return_lines=True).get('line_ids', []):
+            if line[2].get('mollie_transaction_id') and line[2].get('mollie_transaction_id') not in usd_lines:
+                mollie_transaction_ids.add(line[2]['mollie_transaction_id'])
+            else:
+                new_lines.append(line)
+
+        stale_lines = stat.line_ids.filtered(lambda l: l.mollie_transaction_id and l.mollie_transaction_id not in mollie_transaction_ids)
+        reconciled_lines = stale_lines.filtered(lambda l: l.state != 'confirm' and l.journal_entry_ids)
+        if reconciled_lines:
+            reconciled_lines.button_cancel_reconciliation()
+        stale_lines.unlink()
+        valid_lines = stat.line_ids - stale_lines
+
+        # FIX Rounding issues
+        amounts = valid_lines.mapped('amount') + [line[2]['amount'] for line in new_lines]
+        lines_total = sum((Decimal(str(amount)) for amount in amounts), Decimal(0))
+        rounding_line, lines_total = self._mollie_compute_rounding(lines_total, stat.date)
+        if rounding_line:
+            new_lines.append((0, 0, rounding_line))
+
+        stat.write({
+            'line_ids': new_lines,
+            'balance_start': balance_start,
+            'balance_end_real': float(Decimal(str(balance_start)) + lines_total),
+        })
 
     # =================
     # API CALLS METHODS
@@ -291,52 +706,224 @@ class AccountJournal(models.Model):
 
     def _api_get_settlements(self, limit=None):
         """ Fetch settlements data from mollie api"""
-        api_endpoint = "https://api.mollie.com/v2/settlements"
+        api_endpoint = self._mollie_get_api_url('settlements')
         if limit:
             api_endpoint += '?limit=' + str(limit)
         return self._mollie_api_call(api_endpoint)
 
+    def _api_get_settlements_since(self, settlement_id=None):
+        """ Fetch settlements newer than given settlement. Mollie lists newest settlements first
+            so pages are followed (next links use `from`) until the given settlement is reached.
+            Without settlement only the first page is fetched.
+
+            :return: list of settlements data, newest first
+        """
+        api_endpoint = self._mollie_get_api_url('settlements?limit=%s' % SETTLEMENT_PAGE_SIZE)
+        settlements = []
+        while api_endpoint:
+            settlements_data = self._mollie_api_call(api_endpoint)
+            for settlement in settlements_data['_embedded']['settlements'] if settlements_data['count'] else []:
+                if settlement['id'] == settlement_id:
+                    return settlements
+                settlements.append(settlement)
+            if not settlement_id:
+                break
+            api_endpoint = settlements_data['_links'].get('next') and settlements_data['_links']['next']['href']
+        return settlements
+
+    def _api_get_settlements_by_ids(self, settlement_ids):
+        """ Settlements of the cache are not fetched again (e.g. prefetched by the wizard)
+
+            :return: list of settlements data in the order of given ids
+        """
+        cached_settlements = self.env['mollie.settlement.cache']._get_cached_settlements(self, settlement_ids)
+        settlements = []
+        for settlement_id in settlement_ids:
+            if settlement_id in cached_settlements:
+                settlements.append(cached_settlements[settlement_id]._get_settlement())
+            else:
+                settlements.append(self._mollie_api_call(self._mollie_get_api_url('settlements/%s' % settlement_id)))
+        return settlements
+
     def _api_get_settlement_payments(self, settlement_id):
         """ Fetch settlements data from mollie api"""
-        api_endpoint = "https://api.mollie.com/v2/settlements/%s/payments" % settlement_id
-        payment_data = self._api_call_payments_recursive(api_endpoint)
-        return payment_data
-
-    def _api_call_payments_recursive(self, api_endpoint):
-        payments = []
-        payment_data = self._mollie_api_call(api_endpoint)
-        if payment_data and payment_data['count'] > 0:
-            payments.extend(payment_data['_embedded']['payments'])
-        if payment_data["_links"]['next']:
-            next_payments = self._api_call_payments_recursive(payment_data["_links"]['next']['href'])
-            payments.extend(next_payments)
-        return payments
+        api_endpoint = self._mollie_get_api_url('settlements/%s/payments' % settlement_id)
+        return _mollie_fetch_list(api_endpoint, self._get_mollie_api_key(), 'payments', self._mollie_metric_tags())
 
     def _api_get_settlement_refunds(self, settlement_id):
         """ Fetch settlements data from mollie api"""
-        api_endpoint = "https://api.mollie.com/v2/settlements/%s/refunds" % settlement_id
-        refund_data = self._api_call_refunds_recursive(api_endpoint)
-        return refund_data
-
-    def _api_call_refunds_recursive(self, api_endpoint):
-        refunds = []
-        refund_data = self._mollie_api_call(api_endpoint)
-        if refund_data and refund_data['count'] > 0:
-            refunds.extend(refund_data['_embedded']['refunds'])
-        if refund_data["_links"]['next']:
-            next_refunds = self._api_call_refunds_recursive(refund_data["_links"]['next']['href'])
-            refunds.extend(next_refunds)
-        return refunds
+        api_endpoint = self._mollie_get_api_url('settlements/%s/refunds' % settlement_id)
+        return _mollie_fetch_list(api_endpoint, self._get_mollie_api_key(), 'refunds', self._mollie_metric_tags())
+
+    def _api_iter_settlements_details(self, settlements):
+        """ Fetch payments and refunds of settlements on a thread pool. Only a limited number
+            of settlements are fetched in advance and their records are streamed page by page,
+            so the memory does not depend on the size of the settlements.
+            Paid out settlements are served from the local cache once they have been fetched.
+
+            :param settlements: list of settlements data
+            :return: generator of (settlement, payments, refunds) in the order of settlements,
+                     payments and refunds are iterables which can be read only once
+        """
+        if not settlements:
+            return
+        SettlementCache = self.env['mollie.settlement.cache']
+        cached_settlements = SettlementCache._get_cached_settlements(self, [settlement['id'] for settlement in settlements])
+        api_key = self._get_mollie_api_key()
+        metric_tags = self._mollie_metric_tags()
+        concurrency = self._mollie_get_fetch_concurrency()
+        settlements = iter(settlements)
+        pending = deque()
+        current = None
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+            def submit(settlement):
+                if settlement['id'] in cached_settlements:
+                    pending.append((settlement, None, None))
+                    return
+                endpoint = self._mollie_get_api_url('settlements/%s/' % settlement['id'])
+                pending.append((
+                    settlement,
+                    MollieListStream(executor, endpoint + 'payments', api_key, 'payments', metric_tags),
+                    MollieListStream(executor, endpoint + 'refunds', api_key, 'refunds', metric_tags),
+                ))
+
+            try:
+                for settlement in settlements:
+                    submit(settlement)
+                    if len(pending) >= concurrency:
+                        break
+                while pending:
+                    current = pending.popleft()
+                    settlement, payments, refunds = current
+                    next_settlement = next(settlements, None)
+                    if next_settlement:
+                        submit(next_settlement)
+                    if payments is None:
+                        cache = cached_settlements[settlement['id']]
+                        yield settlement, cache._get_payments(), cache._get_refunds()
+                        continue
+                    # Records are compressed for the cache while they are imported, unless
+                    # the settlement is too big to be cached
+                    payments_compressor = RecordsCompressor(CACHE_ENTRY_MAX_SIZE)
+                    refunds_compressor = RecordsCompressor(CACHE_ENTRY_MAX_SIZE)
+                    yield settlement, payments_compressor.feed(payments), refunds_compressor.feed(refunds)
+                    if payments_compressor.complete and refunds_compressor.complete:
+                        payments_data, refunds_data = payments_compressor.getvalue(), refunds_compressor.getvalue()
+                        if payments_data is not None and refunds_data is not None:
+                            SettlementCache._store_compressed_settlement(self, settlement, payments_data, refunds_data)
+            finally:
+                # Workers of unread streams are waiting for their reader
+                if current:
+                    pending.appendleft(current)
+                for settlement, payments, refunds in pending:
+                    if payments is not None:
+                        payments.cancel()
+                        refunds.cancel()
+
+    @mollie_api_caller('settlement_prefetch')
+    def _api_prefetch_settlements_details(self, settlement_ids):
+        """ Fetch payments and refunds of paid out settlements in background (e.g. while the
+            user selects settlements in the wizard). They are stored in the settlement cache
+            with a dedicated cursor, so the import reads them whichever worker runs it.
+        """
+        global _prefetch_executor
+        self.ensure_one()
+        cached_settlements = self.env['mollie.settlement.cache']._get_cached_settlements(self, settlement_ids)
+        api_key = self._get_mollie_api_key()
+        metric_tags = self._mollie_metric_tags()
+        journal_id, dbname = self.id, self.env.cr.dbname
+
+        def store(env, prefetched):
+            if prefetched:
+                env['mollie.settlement.cache']._store_compressed_settlement(env['account.journal'].browse(journal_id), *prefetched)
+
+        def prefetch(settlement_id, endpoint):
+            try:
+                prefetched = _mollie_prefetch_settlement(endpoint, api_key, metric_tags)
+                with api.Environment.manage(), self.pool.cursor() as cr:
+                    store(api.Environment(cr, SUPERUSER_ID, {}), prefetched)
+            except Exception:
+                _logger.warning('Mollie SYNC: prefetch of settlement %s failed', settlement_id, exc_info=True)
+            finally:
+                with _prefetch_lock:
+                    _prefetching.discard((dbname, journal_id, settlement_id))
+
+        for settlement_id in settlement_ids:
+            if settlement_id in cached_settlements:
+                continue
+            endpoint = self._mollie_get_api_url('settlements/%s' % settlement_id)
+            if getattr(threading.current_thread(), 'testing', False):
+                # Test data is not visible from another cursor
+                store(self.env, _mollie_prefetch_settlement(endpoint, api_key, metric_tags))
+                continue
+            with _prefetch_lock:
+                if (dbname, journal_id, settlement_id) in _prefetching:
+                    continue
+                _prefetching.add((dbname, journal_id, settlement_id))
+                if not _prefetch_executor:
+                    _prefetch_executor = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY)
+                _prefetch_executor.submit(prefetch, settlement_id, endpoint)
 
     def _api_call_get_order_meta(self, order_id):
-        api_endpoint = "https://api.mollie.com/v2/orders/%s" % order_id
-        order = self._mollie_api_call(api_endpoint)
-        data = {}
-        if order.get('metadata'):
-            data.update(order['metadata'])
-        if order.get('billingAddress'):
-            data.update(order['billingAddress'])
-        return data
+        return self._api_get_orders_meta([order_id])[order_id]
+
+    @mollie_api_caller('order_info')
+    def _api_get_orders_meta(self, order_ids, raise_exception=True):
+        """ Get metadata and billing address of mollie orders. Metadata is cached for some
+            time (statement info widget asks it for every line) and missing orders are
+            fetched concurrently.
+
+            :param order_ids: list of mollie order ids
+            :param raise_exception: if False orders which can not be fetched are skipped
+            :return: dict of order id and its metadata
+        """
+        result = {}
+        order_ids_to_fetch = []
+        now = time.monotonic()
+        with _order_meta_lock:
+            for order_id in order_ids:
+                cached = _order_meta_cache.get((self.id, order_id))
+                if cached and cached[0] > now:
+                    result[order_id] = cached[1]
+                else:
+                    order_ids_to_fetch.append(order_id)
+        if not order_ids_to_fetch:
+            return result
+
+        api_key = self._get_mollie_api_key()
+        metric_tags = self._mollie_metric_tags()
+
+        order_url = self._mollie_get_api_url('orders/%s')
+
+        def fetch_order(order_id):
+            try:
+                return _mollie_fetch(order_url % order_id, api_key, metric_tags)
+            except UserError:
+                if raise_exception:
+                    raise
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(self._mollie_get_fetch_concurrency(), len(order_ids_to_fetch))) as executor:
+            orders = list(executor.map(fetch_order, order_ids_to_fetch))
+
+        expire_at = time.monotonic() + ORDER_META_TTL
+        with _order_meta_lock:
+            for order_id, order in zip(order_ids_to_fetch, orders):
+                if order is None:
+                    continue
+                data = {}
+                if order.get('metadata'):
+                    data.update(order['metadata'])
+                if order.get('billingAddress'):
+                    data.update(order['billingAddress'])
+                result[order_id] = data
+                _order_meta_cache[(self.id, order_id)] = (expire_at, data)
+                _order_meta_cache.move_to_end((self.id, order_id))
+            while len(_order_meta_cache) > ORDER_META_CACHE_SIZE:
+                _order_meta_cache.popitem(last=False)
+        return result
 
     # =====================
     # GENERIC TOOLS METHODS
@@ -350,40 +937,26 @@ class AccountJournal(models.Model):
             api_key += 'Bearer '
         return api_key + self.mollie_api_key
 
+    def _mollie_get_api_url(self, path):
+        """ :return: url of given path of mollie api (see `_mollie_get_api_endpoint` of acquirer) """
+        return '%s/v2/%s' % (self.env['payment.acquirer']._mollie_get_api_endpoint().rstrip('/'), path)
+
     def _mollie_api_call(self, api_endpoint):
-        headers = {
-            'content-type': 'application/json',
-            'Authorization': self._get_mollie_api_key()
-        }
-        _logger.info('Mollie SYNC CALL on: %s', api_endpoint)
-        try:
-            req = requests.get(api_endpoint, timeout=TIMEOUT, headers=headers)
-            req.raise_for_status()
-            return req.json()
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
-            _logger.error('Mollie SYNC issue: %s', e)
-            raise UserError(_('Some thing went wrong please try again after some time.'))
+        return _mollie_fetch(api_endpoint, self._get_mollie_api_key(), self._mollie_metric_tags())
+
+    def _mollie_metric_tags(self):
+        """ Tags of the api calls of this journal, caller is the flow running in this thread """
+        return MollieMetricTags(self.env.cr.dbname, 'journal:%s' % self.id, mollie_api_current_caller())
+
+    def _mollie_get_fetch_concurrency(self):
+        concurrency = self.env['ir.config_parameter'].sudo().get_param('mollie_account_sync.fetch_concurrency')
+        return max(int(concurrency or FETCH_CONCURRENCY), 1)
 
     def _format_mollie_date(self, date_str):
-        return datetime.strftime(datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S+00:00"), '%Y-%m-%d')
+        return fields.Date.to_string(parse_mollie_datetime(date_str))
 
     def _generate_payment_ref(self, metadata):
-        metadata = metadata or {}
-        ref = ""
-        if metadata.get('customer'):
-            if metadata['customer'].get('firstName'):
-                ref += metadata['customer']['firstName']
-            if metadata['customer'].get('lastName'):
-                if ref:
-                    ref += ' '  # space for first and last name
-                ref += metadata['customer']['lastName']
-        if metadata.get('reference'):
-            if ref:
-                ref += ' #'  # space
-            else:
-                ref += '#'  # space
-            ref += metadata['reference']
-        return ref
+        return mollie_payment_ref(metadata)
 
     def get_payment_fees_lines(self, settlement_data):
 
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, tools
+
+
+class AccountPayment(models.Model):
+    _inherit = "account.payment"
+
+    def init(self):
+        """ Draft transfers are counted per journal on every dashboard load, this partial
+            index only contains those payments so it stays small.
+        """
+        super(AccountPayment, self).init()
+        if tools.column_exists(self.env.cr, 'account_payment', 'payment_type') and tools.column_exists(self.env.cr, 'account_payment', 'state'):
+            self.env.cr.execute("""
+                CREATE INDEX IF NOT EXISTS account_payment_mollie_draft_transfer_index
+                ON account_payment (journal_id)
+                WHERE payment_type = 'transfer' AND state = 'draft'
+            """)
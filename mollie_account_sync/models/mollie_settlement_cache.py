@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+import logging
+import zlib
+
+from psycopg2 import errorcodes, IntegrityError
+
+from odoo import api, fields, models
+from odoo.tools import mute_logger
+
+_logger = logging.getLogger(__name__)
+
+CACHE_SIZE_MB = 256
+CACHE_ENTRY_MAX_SIZE = 16 * 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class RecordsCompressor(object):
+    """ Compress records as newline delimited json while they are read, so they can be
+        stored without keeping them all in memory.
+
+        :param max_size: compressed size above which records are not kept anymore (`overflow`
+                         is set), so the memory is bounded whatever the number of records
+    """
+
+    def __init__(self, max_size=None):
+        self._compressor = zlib.compressobj()
+        self._chunks = []
+        self.max_size = max_size
+        self.complete = False
+        self.overflow = False
+        self.size = 0
+
+    def add(self, record):
+        if self.overflow:
+            return
+        chunk = self._compressor.compress(json.dumps(record).encode() + b'\n')
+        self._chunks.append(chunk)
+        self.size += len(chunk)
+        if self.max_size and self.size > self.max_size:
+            self.overflow = True
+            self._chunks = []
+
+    def feed(self, records):
+        """ Generator of given records, `complete` is set once all of them are read """
+        for record in records:
+            self.add(record)
+            yield record
+        self.complete = True
+
+    def getvalue(self):
+        """ :return: compressed records, None if they are too big to be kept """
+        if self.overflow:
+            return None
+        value = b''.join(self._chunks) + self._compressor.flush()
+        if self.max_size and len(value) > self.max_size:
+            self.overflow = True
+            self._chunks = []
+            return None
+        return value
+
+
+def _compress_records(records):
+    """ Compress records as newline delimited json so they can be read back one by one """
+    compressor = RecordsCompressor()
+    for record in records:
+        compressor.add(record)
+    return compressor.getvalue()
+
+
+def _decompress_records(data):
+    """ Generator of the records compressed with `_compress_records` """
+    decompressor = zlib.decompressobj()
+    buffer = b''
+    for index in range(0, len(data), READ_CHUNK_SIZE):
+        buffer += decompressor.decompress(data[index:index + READ_CHUNK_SIZE])
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield json.loads(line)
+    buffer += decompressor.flush()
+    for line in buffer.split(b'\n'):
+        if line:
+            yield json.loads(line)
+
+
+class MollieSettlementCache(models.Model):
+    """ Payments and refunds of a paid out settlement never change, so they are stored
+        the first time they are fetched and later imports (or rechecks) read them locally.
+    """
+    _name = 'mollie.settlement.cache'
+    _description = 'Mollie settlement cache'
+    _order = 'create_date desc, id desc'
+
+    name = fields.Char(string="Settlement ID", required=True, index=True)
+    journal_id = fields.Many2one('account.journal', required=True, ondelete='cascade')
+    settlement_data = fields.Binary(attachment=False)
+    payments_data = fields.Binary(attachment=False)
+    refunds_data = fields.Binary(attachment=False)
+    data_size = fields.Integer(help="Size of compressed data in bytes")
+
+    _sql_constraints = [
+        ('name_journal_uniq', 'unique(name, journal_id)', 'Settlement is already cached for this journal!'),
+    ]
+
+    @api.model
+    def _get_cached_settlements(self, journal, settlement_ids):
+        """ :return: dict of settlement id and cache record """
+        caches = self.sudo().search([('journal_id', '=', journal.id), ('name', 'in', list(settlement_ids))])
+        return {cache.name: cache for cache in caches}
+
+    def _get_settlement(self):
+        return next(_decompress_records(base64.b64decode(self.settlement_data or b'')), None)
+
+    def _get_payments(self):
+        return _decompress_records(base64.b64decode(self.payments_data or b''))
+
+    def _get_refunds(self):
+        return _decompress_records(base64.b64decode(self.refunds_data or b''))
+
+    @api.model
+    def _store_compressed_settlement(self, journal, settlement, payments_data, refunds_data):
+        """ :param payments_data: payments compressed with `_compress_records` (same for refunds_data) """
+        if settlement['status'] != 'paidout':
+            return self
+        existing_cache = self._get_cached_settlements(journal, [settlement['id']]).get(settlement['id'])
+        if existing_cache:
+            return existing_cache
+        compressed_data = {
+            'settlement_data': _compress_records([settlement]),
+            'payments_data': payments_data,
+            'refunds_data': refunds_data,
+        }
+        vals = {field: base64.b64encode(data) for field, data in compressed_data.items()}
+        vals.update({
+            'name': settlement['id'],
+            'journal_id': journal.id,
+            'data_size': sum(len(data) for data in compressed_data.values()),
+        })
+        try:
+            # Same settlement may be stored at the same time by the cron, the wizard or a prefetch
+            with mute_logger('odoo.sql_db'), self.env.cr.savepoint():
+                cache = self.sudo().create(vals)
+        except IntegrityError as e:
+            if e.pgcode != errorcodes.UNIQUE_VIOLATION:
+                raise
+            # Stored by a concurrent transaction, not visible from this one
+            return self
+        self._evict_oldest()
+        return cache
+
+    @api.model
+    def _evict_oldest(self):
+        """ Remove the oldest entries once the cache is bigger than its maximum size """
+        max_size = int(self.env['ir.config_parameter'].sudo().get_param('mollie_account_sync.settlement_cache_size', CACHE_SIZE_MB)) * 1024 * 1024
+        total_size = 0
+        ids_to_remove = []
+        for cache in self.sudo().search_read([], ['data_size']):
+            total_size += cache['data_size']
+            if total_size > max_size:
+                ids_to_remove.append(cache['id'])
+        if ids_to_remove:
+            _logger.info('Mollie settlement cache is full, removing %s entries', len(ids_to_remove))
+            self.sudo().browse(ids_to_remove).unlink()
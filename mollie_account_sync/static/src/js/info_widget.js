@@ -5,9 +5,71 @@ odoo.define('drgl.payment_info.widget', function (require) {
     var fieldRegistry = require('web.field_registry');
     var Dialog = require('web.Dialog');
     var core = require('web.core');
+    var ajax = require('web.ajax');
 
     var QWeb = core.qweb;
 
+    var BATCH_SIZE = 100;
+    var PENDING_TIMEOUT = 5000;
+    var orderInfoCache = {};
+    var queuedOrders = {};
+
+    // Statement lines are rendered one by one, requested orders are collected
+    // and asked with a single call per journal. The call does not belong to a
+    // widget so it is done even if the lines are rendered again meanwhile.
+    var flushOrderQueue = _.debounce(function () {
+        var queue = queuedOrders;
+        queuedOrders = {};
+        _.each(queue, function (resolvers, journal_id) {
+            var orderIds = _.keys(resolvers);
+            for (var i = 0; i < orderIds.length; i += BATCH_SIZE) {
+                (function (chunk) {
+                    ajax.rpc('/get_mollie_orders_info', {
+                        order_ids: chunk,
+                        journal_id: parseInt(journal_id)
+                    }).then(function (result) {
+                        _.each(chunk, function (order_id) {
+                            resolvers[order_id](result[order_id] || null);
+                        });
+                    }, function () {
+                        _.each(chunk, function (order_id) {
+                            resolvers[order_id](null);
+                        });
+                    });
+                })(orderIds.slice(i, i + BATCH_SIZE));
+            }
+        });
+    }, 100);
+
+    function queueOrder(journal_id, order_id) {
+        var cacheKey = journal_id + '-' + order_id;
+        if (orderInfoCache[cacheKey]) {
+            return;
+        }
+        var settled = false;
+        var promise = new Promise(function (resolve) {
+            var timeout = setTimeout(function () {
+                done(null);
+            }, PENDING_TIMEOUT);
+            function done(result) {
+                if (settled) {
+                    return;
+                }
+                settled = true;
+                clearTimeout(timeout);
+                // Missing, failed or too slow: dropped so a click asks it alone
+                if (!result && orderInfoCache[cacheKey] === promise) {
+                    delete orderInfoCache[cacheKey];
+                }
+                resolve(result);
+            }
+            queuedOrders[journal_id] = queuedOrders[journal_id] || {};
+            queuedOrders[journal_id][order_id] = done;
+        });
+        orderInfoCache[cacheKey] = promise;
+        flushOrderQueue();
+    }
+
 
     var PaymentInfo = AbstractField.extend({
 
@@ -18,27 +80,47 @@ odoo.define('drgl.payment_info.widget', function (require) {
         _renderReadonly: function () {
             this._super();
             this.$el.append('<button type="button" class="btn btn-sm fa fa-info d_more_info" title="Info"></button>');
+            this._preloadOrderInfo();
         },
-        _onClickInfo: function (ev) {
-            ev.stopPropagation();
-            ev.preventDefault();
-            var self = this;
+        _getOrderKey: function () {
             if (this.value) {
                 var data = JSON.parse(this.value);
                 var journal_id = this.recordData.journal_id && this.recordData.journal_id.res_id;
                 if (data.mollie_order_id && journal_id) {
-                    this._rpc({
+                    return {order_id: data.mollie_order_id, journal_id: journal_id};
+                }
+            }
+            return false;
+        },
+        _preloadOrderInfo: function () {
+            var key = this._getOrderKey();
+            if (key) {
+                queueOrder(key.journal_id, key.order_id);
+            }
+        },
+        _onClickInfo: function (ev) {
+            ev.stopPropagation();
+            ev.preventDefault();
+            var self = this;
+            var key = this._getOrderKey();
+            if (key) {
+                var cacheKey = key.journal_id + '-' + key.order_id;
+                var cached = orderInfoCache[cacheKey] || Promise.resolve(null);
+                cached.then(function (result) {
+                    if (result) {
+                        return result;
+                    }
+                    // Not preloaded or preload failed: ask it alone
+                    delete orderInfoCache[cacheKey];
+                    return self._rpc({
                         route: '/get_mollie_order_info',
-                        params: {
-                            order_id: data.mollie_order_id,
-                            journal_id: journal_id
-                        },
-                    }).then(function (result) {
-                        self._openDialog(result);
+                        params: key,
                     });
-                } else {
-                    this._openDialog(data);
-                }
+                }).then(function (result) {
+                    self._openDialog(result);
+                });
+            } else if (this.value) {
+                this._openDialog(JSON.parse(this.value));
             }
         },
         _openDialog: function (data) {
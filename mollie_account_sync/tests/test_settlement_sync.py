@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+from odoo.tests.common import SavepointCase
+
+from odoo.addons.mollie_account_sync.models.mollie_settlement_cache import _compress_records
+from odoo.addons.payment_mollie_official.tests.common import MOLLIE_TEST_API_KEY, MollieFakeServerMixin, mollie_benchmark
+
+SETTLEMENT_PAYMENTS = 50000
+SETTLEMENT_REFUNDS = 1000
+
+
+class MollieSettlementCommon(MollieFakeServerMixin, SavepointCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.journal = cls.env['account.journal'].create({
+            'name': 'Mollie',
+            'code': 'MOLL',
+            'type': 'bank',
+            'bank_statements_source': 'mollie_sync',
+            'mollie_api_key': MOLLIE_TEST_API_KEY,
+        })
+
+    def setUp(self):
+        super().setUp()
+        self.mollie_server.clear_settlements()
+
+    def _get_statement(self, settlement):
+        return self.env['account.bank.statement'].search([('mollie_settlement_id', '=', settlement['id'])])
+
+
+@tagged('post_install', '-at_install')
+class TestMollieSettlementSync(MollieSettlementCommon):
+    mollie_server_options = {'page_size': 3, 'rate_limit_every': 4}
+
+    def test_sync_new_settlements(self):
+        settlement = self.mollie_server.add_settlement(7, 2)
+
+        result = self.journal._mollie_sync_new_settlements()
+
+        self.assertEqual(result, {'imported': 1, 'skipped': 0})
+        statement = self._get_statement(settlement)
+        self.assertEqual(len(statement.line_ids), 7 + 2 + 1, "Every payment and refund of all the pages and fees should be imported")
+        self.assertAlmostEqual(sum(statement.line_ids.mapped('amount')), float(settlement['amount']['value']), places=2)
+        self.assertTrue(self.mollie_server.rate_limited_count, "Rate limited calls should have been retried")
+        self.assertEqual(self.journal.mollie_last_settlement_id, settlement['id'])
+
+        # Only newer settlements are asked to mollie
+        self.assertEqual(self.journal._mollie_sync_new_settlements(), {'imported': 0, 'skipped': 0})
+
+    def test_prefetch_settlement(self):
+        """ Prefetched settlements are stored in the cache, the import does not fetch them again """
+        settlement = self.mollie_server.add_settlement(7, 2)
+        open_settlement = self.mollie_server.add_settlement(1)
+        open_settlement['status'] = 'open'
+
+        self.journal._api_prefetch_settlements_details([settlement['id'], open_settlement['id']])
+
+        cached_settlements = self.env['mollie.settlement.cache']._get_cached_settlements(self.journal, [settlement['id'], open_settlement['id']])
+        self.assertEqual(list(cached_settlements), [settlement['id']])
+        payments_path = '/v2/settlements/%s/payments' % settlement['id']
+        payments_calls = self.mollie_server.count_requests('GET', payments_path)
+
+        self.journal._process_settlements({'count': 1, '_embedded': {'settlements': [settlement]}})
+
+        self.assertEqual(len(self._get_statement(settlement).line_ids), 7 + 2 + 1)
+        self.assertEqual(self.mollie_server.count_requests('GET', payments_path), payments_calls)
+
+    def test_cache_concurrent_store(self):
+        """ Settlement stored by another transaction in the meantime does not abort the import """
+        settlement = self.mollie_server.add_settlement(1)
+        SettlementCache = self.env['mollie.settlement.cache']
+        payments_data, refunds_data = _compress_records([{'id': 'tr_1'}]), _compress_records([])
+        cache = SettlementCache._store_compressed_settlement(self.journal, settlement, payments_data, refunds_data)
+        self.assertEqual(SettlementCache._store_compressed_settlement(self.journal, settlement, payments_data, refunds_data), cache)
+
+        # Not visible yet when the other transaction stores it
+        with patch.object(type(SettlementCache), '_get_cached_settlements', return_value={}):
+            self.assertFalse(SettlementCache._store_compressed_settlement(self.journal, settlement, payments_data, refunds_data))
+        self.assertEqual(SettlementCache.search_count([('name', '=', settlement['id'])]), 1)
+
+    def test_cache_too_big_settlement(self):
+        """ Settlements too big to be cached are imported without being kept in memory """
+        small, big = self.mollie_server.add_settlement(1), self.mollie_server.add_settlement(20, 2)
+
+        with patch('odoo.addons.mollie_account_sync.models.account_journal.CACHE_ENTRY_MAX_SIZE', 300):
+            self.journal._process_settlements({'count': 2, '_embedded': {'settlements': [big, small]}})
+
+        self.assertEqual(len(self._get_statement(big).line_ids), 20 + 2 + 1)
+        cached_settlements = self.env['mollie.settlement.cache']._get_cached_settlements(self.journal, [small['id'], big['id']])
+        self.assertEqual(list(cached_settlements), [small['id']])
+
+    def test_wizard_sync(self):
+        """ Wizard imports the selected settlements, prefetched or not """
+        prefetched = self.mollie_server.add_settlement(2)
+        settlement = self.mollie_server.add_settlement(3, 1)
+        wizard = self.env['wiz.mollie.init'].with_context(default_journal_id=self.journal.id).create({})
+        self.assertEqual(wizard.settlement_lines.mapped('settlement_id'), [settlement['id'], prefetched['id']])
+        self.journal._api_prefetch_settlements_details([prefetched['id']])
+        prefetched_path = '/v2/settlements/%s' % prefetched['id']
+        prefetched_calls = self.mollie_server.count_requests('GET', prefetched_path)
+
+        wizard.settlement_lines.write({'do_sync': True})
+        wizard.sync_settlement()
+
+        self.assertEqual(len(self._get_statement(prefetched).line_ids), 2 + 1)
+        self.assertEqual(len(self._get_statement(settlement).line_ids), 3 + 1 + 1)
+        self.assertEqual(self.mollie_server.count_requests('GET', prefetched_path), prefetched_calls, "Prefetched settlement should be read from the cache")
+
+    def test_sync_cursor_open_settlement(self):
+        """ Cursor stops on the newest final settlement, the open one is imported by the next sync """
+        first = self.mollie_server.add_settlement(2)
+        self.journal._mollie_sync_new_settlements()
+        self.assertEqual(self.journal.mollie_last_settlement_id, first['id'])
+
+        second = self.mollie_server.add_settlement(2)
+        third = self.mollie_server.add_settlement(2, 1)
+        current = self.mollie_server.add_settlement(1)
+        current['status'] = 'open'
+
+        result = self.journal._mollie_sync_new_settlements()
+
+        self.assertEqual(result, {'imported': 2, 'skipped': 1})
+        self.assertTrue(self._get_statement(second))
+        self.assertTrue(self._get_statement(third))
+        self.assertFalse(self._get_statement(current))
+        self.assertEqual(self.journal.mollie_last_settlement_id, third['id'])
+
+        current['status'] = 'paidout'
+        self.assertEqual(self.journal._mollie_sync_new_settlements(), {'imported': 1, 'skipped': 0})
+        self.assertTrue(self._get_statement(current))
+        self.assertEqual(self.journal.mollie_last_settlement_id, current['id'])
+
+
+    def test_sync_journals_threaded(self):
+        """ Every journal is synced in its own thread and cursor, a failing journal is rolled back alone """
+        failing_journal = self.journal.copy({'name': 'Mollie Failing', 'code': 'MOLF'})
+        settlement = self.mollie_server.add_settlement(3, 1)
+        sync_new_settlements = type(self.journal)._mollie_sync_new_settlements
+
+        def sync(journal):
+            if journal == failing_journal:
+                journal.mollie_last_sync = fields.Datetime.now()
+                raise UserError('Invalid API key')
+            return sync_new_settlements(journal)
+
+        # Threads use the cursor of the test
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        with patch.object(type(self.journal), '_mollie_sync_new_settlements', autospec=True, side_effect=sync) as sync_mock:
+            results = (self.journal | failing_journal)._mollie_sync_journals()
+
+        self.assertEqual(sync_mock.call_count, 2)
+        self.assertTrue(all(args[0].env.cr is not self.env.cr for args, kwargs in sync_mock.call_args_list), "Journals should be synced with their own cursor")
+        self.assertEqual(results, {
+            self.journal.id: {'imported': 1, 'skipped': 0},
+            failing_journal.id: {'error': 'Invalid API key'},
+        })
+        self.env['account.journal'].invalidate_cache()
+        self.assertEqual(len(self._get_statement(settlement).line_ids), 3 + 1 + 1)
+        self.assertEqual(self.journal.mollie_last_settlement_id, settlement['id'])
+        self.assertFalse(failing_journal.mollie_last_sync, "Changes of the failing journal should be rolled back")
+
+
+@tagged('post_install', '-at_install', '-standard', 'mollie_benchmark')
+class TestMollieSettlementBenchmark(MollieSettlementCommon):
+    """ Import of the biggest settlements, run with `--test-tags mollie_benchmark` """
+    mollie_server_options = {'page_size': 250, 'latency': 0.02, 'rate_limit_every': 50}
+
+    def test_import_big_settlement(self):
+        settlement = self.mollie_server.add_settlement(SETTLEMENT_PAYMENTS, SETTLEMENT_REFUNDS)
+
+        with mollie_benchmark('import of a settlement with %s payments' % SETTLEMENT_PAYMENTS, self.cr):
+            self.journal._process_settlements({'count': 1, '_embedded': {'settlements': [settlement]}})
+
+        statement = self._get_statement(settlement)
+        lines_count = self.env['account.bank.statement.line'].search_count([('statement_id', '=', statement.id)])
+        self.assertEqual(lines_count, SETTLEMENT_PAYMENTS + SETTLEMENT_REFUNDS + 1)
+        self.assertAlmostEqual(statement.balance_end_real - statement.balance_start, float(settlement['amount']['value']), places=2)
@@ -42,27 +42,30 @@ class MollieInit(models.TransientModel):
     def on_change_sync_all(self):
         for line in self.settlement_lines:
             line.do_sync = self.sync_all
+        self._prefetch_selected_settlements()
+
+    @api.onchange('settlement_lines')
+    def on_change_settlement_lines(self):
+        self._prefetch_selected_settlements()
+
+    def _prefetch_selected_settlements(self):
+        """ Download selected settlements while user is still choosing so sync only has to create statements """
+        settlement_ids = self.settlement_lines.filtered('do_sync').mapped('settlement_id')
+        if self.journal_id and settlement_ids:
+            self.journal_id._api_prefetch_settlements_details(settlement_ids)
 
     def sync_settlement(self):
         self.ensure_one()
         line_to_sync = self.settlement_lines.filtered('do_sync')
         journal = self.journal_id
         if line_to_sync and journal:
-            settlements_data = self.journal_id._api_get_settlements(limit=LIMIT)
-            mollie_ids_to_sync = line_to_sync.mapped('settlement_id')
-
-            new_list = []
-            if settlements_data['count'] == 0:
-                return []
-
-            for settlement in settlements_data['_embedded']['settlements']:
-                if settlement['id'] in mollie_ids_to_sync:
-                    new_list.append(settlement)
-            settlements_data['_embedded']['settlements'] = new_list
-            settlements_data['count'] = len(new_list)
-            if new_list:
-                journal._process_settlements(settlements_data)
-                journal.mollie_last_sync = fields.Datetime.now()
+            # Settlements prefetched while the user was choosing are read from the cache
+            settlements = journal._api_get_settlements_by_ids(line_to_sync.mapped('settlement_id'))
+            journal._process_settlements({
+                'count': len(settlements),
+                '_embedded': {'settlements': settlements}
+            })
+            journal.mollie_last_sync = fields.Datetime.now()
 
 
 class MollieInitLines(models.TransientModel):
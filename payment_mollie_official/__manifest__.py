@@ -27,7 +27,11 @@
         'views/payment_views.xml',
         'views/payment_mollie_templates.xml',
         'views/account_move_view.xml',
+        'views/mollie_webhook_event_views.xml',
+        'views/mollie_api_metric_views.xml',
+        'wizard/mollie_refund_views.xml',
         'data/payment_acquirer_data.xml',
+        'data/ir_cron_data.xml',
     ],
 
     'images': [
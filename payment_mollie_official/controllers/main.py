@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import hmac
 import werkzeug
 import logging
 
 from odoo import http
 from odoo.http import request
 
+from odoo.addons.payment_mollie_official.models.mollie_api_metric import mollie_api_caller
+
 _logger = logging.getLogger(__name__)
 
 
@@ -24,7 +27,8 @@ class MollieController(http.Controller):
         if post.get('tx'):
             transaction = request.env["payment.transaction"].sudo().browse(int(post.get('tx')))
             if transaction.exists() and transaction.acquirer_reference:
-                data = transaction.acquirer_id._mollie_get_payment_data(transaction.acquirer_reference)
+                with mollie_api_caller('return'):
+                    data = transaction.acquirer_id._mollie_get_payment_data(transaction.acquirer_reference)
                 request.env["payment.transaction"].sudo().form_feedback(data, "mollie")
         return werkzeug.utils.redirect("/payment/process")
 
@@ -33,6 +37,21 @@ class MollieController(http.Controller):
         if post.get('tx'):
             transaction = request.env["payment.transaction"].sudo().browse(int(post.get('tx')))
             if transaction.exists() and transaction.acquirer_reference == post.get('id'):
-                data = transaction.acquirer_id._mollie_get_payment_data(transaction.acquirer_reference)
-                request.env["payment.transaction"].sudo().form_feedback(data, "mollie")
+                # Only queue the notification, it is processed by cron so mollie gets answer immediately
+                request.env["mollie.webhook.event"].sudo().create({
+                    'transaction_id': transaction.id,
+                    'mollie_reference': post.get('id'),
+                })
+                request.env.ref('payment_mollie_official.ir_cron_mollie_webhook_events').sudo()._trigger()
         return "ok"
+
+    @http.route("/payment/mollie/metrics", type='http', auth="none", methods=['GET'], csrf=False, sitemap=False)
+    def mollie_metrics(self, token=None, **kwargs):
+        """ Mollie API metrics in prometheus text format, protected by the
+            `payment_mollie_official.metrics_token` system parameter.
+        """
+        metrics_token = request.env['ir.config_parameter'].sudo().get_param('payment_mollie_official.metrics_token')
+        if not metrics_token or not token or not hmac.compare_digest(metrics_token, token):
+            raise werkzeug.exceptions.NotFound()
+        metrics = request.env['mollie.api.metric'].sudo()._mollie_prometheus_metrics()
+        return request.make_response(metrics, headers=[('Content-Type', 'text/plain; version=0.0.4')])
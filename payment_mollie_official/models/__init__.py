@@ -6,3 +6,6 @@ from . import mollie_method
 from . import mollie_issuers
 from . import res_partner
 from . import account_move
+from . import mollie_webhook_event
+from . import mollie_transaction_reference
+from . import mollie_api_metric
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, _
+from odoo import api, models, fields, _
 from odoo.exceptions import UserError
 
+from .mollie_api_metric import mollie_api_caller
+
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -10,16 +12,17 @@ _logger = logging.getLogger(__name__)
 class AccountMove(models.Model):
     _inherit = "account.move"
 
-    valid_for_mollie_refund = fields.Boolean(compute="_compute_valid_for_mollie_refund")
+    valid_for_mollie_refund = fields.Boolean(compute="_compute_valid_for_mollie_refund", store=True, string="Refundable via Mollie")
     mollie_refund_reference = fields.Char()
 
+    @api.depends('move_type', 'state', 'payment_state', 'mollie_refund_reference', 'reversed_entry_id.transaction_ids.state')
     def _compute_valid_for_mollie_refund(self):
+        candidates = self.filtered(lambda move: move.move_type == 'out_refund' and move.state == "posted" and move.payment_state != 'paid' and not move.mollie_refund_reference)
+        mollie_transactions = candidates._get_valid_mollie_transactions()
         for move in self:
-            has_mollie_tx = False
-            if move.move_type == 'out_refund' and move._find_valid_mollie_transactions() and move.state == "posted" and move.payment_state != 'paid':
-                has_mollie_tx = True
-            move.valid_for_mollie_refund = has_mollie_tx
+            move.valid_for_mollie_refund = bool(mollie_transactions.get(move.id))
 
+    @mollie_api_caller('refund')
     def mollie_process_refund(self):
         self.ensure_one()
         mollie_transactions = self._find_valid_mollie_transactions()
@@ -40,9 +43,31 @@ class AccountMove(models.Model):
 
             # Create refund in mollie via API
             refund = mollie_transactions.acquirer_id._api_mollie_refund(self.amount_total, self.currency_id, mollie_transactions.acquirer_reference)
-            if refund['status'] == 'refunded':
-                self.mollie_refund_reference = refund['id']
+            self.mollie_refund_reference = refund['id']
 
     def _find_valid_mollie_transactions(self):
         self.ensure_one()
-        return self.reversed_entry_id.transaction_ids.filtered(lambda tx: tx.state == 'done' and tx.acquirer_id.provider == 'mollie')
+        return self._get_valid_mollie_transactions().get(self.id, self.env['payment.transaction'])
+
+    def _get_valid_mollie_transactions(self):
+        """ Done mollie transactions of the reversed invoices, fetched with one query for all moves.
+
+            :return: dict of move id and its transactions
+        """
+        invoices = self.reversed_entry_id._origin
+        if not invoices:
+            return {}
+        transactions = self.env['payment.transaction'].search([
+            ('invoice_ids', 'in', invoices.ids),
+            ('state', '=', 'done'),
+            ('acquirer_id.provider', '=', 'mollie'),
+        ])
+        transactions_by_invoice = {}
+        for transaction in transactions:
+            for invoice_id in transaction.invoice_ids.ids:
+                transactions_by_invoice.setdefault(invoice_id, self.env['payment.transaction'])
+                transactions_by_invoice[invoice_id] |= transaction
+        return {
+            move.id: transactions_by_invoice[move.reversed_entry_id._origin.id]
+            for move in self if move.reversed_entry_id._origin.id in transactions_by_invoice
+        }
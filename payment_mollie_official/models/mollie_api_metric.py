@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from odoo import SUPERUSER_ID, api, fields, models, sql_db
+
+_logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of latency histogram and their fields, slower calls are only in call_count
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LATENCY_FIELDS = ('latency_100ms', 'latency_250ms', 'latency_500ms', 'latency_1s', 'latency_2500ms', 'latency_5s', 'latency_10s')
+COUNTER_FIELDS = ('call_count', 'error_count', 'retry_count', 'total_duration', 'payload_size') + LATENCY_FIELDS + ('event_count',)
+FLUSH_INTERVAL = 60
+
+# Calls are counted in memory by each worker and saved from time to time
+_pending = {}
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+_local = threading.local()
+
+MollieMetricTags = namedtuple('MollieMetricTags', 'dbname tag caller')
+
+
+@contextmanager
+def mollie_api_caller(caller):
+    """ Name the flow of the mollie calls made in this thread (can be used as decorator) """
+    previous = getattr(_local, 'caller', None)
+    _local.caller = caller
+    try:
+        yield
+    finally:
+        _local.caller = previous
+
+
+def mollie_api_current_caller():
+    return getattr(_local, 'caller', None) or 'other'
+
+
+def mollie_logical_endpoint(http_method, url):
+    """ Name of the api endpoint without ids, e.g. GET .../v2/settlements/stl_x/payments
+        gives `settlements/payments.list` and POST .../v2/orders gives `orders.create`.
+    """
+    path = url.split('?', 1)[0]
+    if '/v2/' in path:
+        path = path.split('/v2/', 1)[1]
+    # Mollie paths alternate resources and ids
+    segments = [segment for segment in path.split('/') if segment]
+    on_item = len(segments) % 2 == 0
+    action = {
+        'GET': 'get' if on_item else 'list',
+        'POST': 'create',
+        'PATCH': 'update',
+        'DELETE': 'delete',
+    }.get(http_method.upper(), http_method.lower())
+    return '%s.%s' % ('/'.join(segments[::2]), action)
+
+
+def mollie_record_call(tags, endpoint, duration, size=0, error=False, retries=0):
+    """ Count a mollie api call. It does not use the ORM so it can be called from a thread.
+
+        :param tags: `MollieMetricTags` of the call
+        :param endpoint: logical endpoint (see `mollie_logical_endpoint`)
+        :param duration: seconds spent in the call (retries included)
+    """
+    if not tags or not tags.dbname:
+        return
+    key = (tags.dbname, endpoint, tags.tag or '', tags.caller or mollie_api_current_caller())
+    bucket = bisect.bisect_left(LATENCY_BUCKETS, duration)
+    with _pending_lock:
+        values = _pending.setdefault(key, [0] * len(COUNTER_FIELDS))
+        values[0] += 1
+        values[1] += int(bool(error))
+        values[2] += retries
+        values[3] += duration
+        values[4] += size
+        if bucket < len(LATENCY_BUCKETS):
+            values[5 + bucket] += 1
+        flush = time.monotonic() - _last_flush > FLUSH_INTERVAL
+    if flush:
+        mollie_flush_metrics()
+
+
+def mollie_record_event(tags, name):
+    """ Count an event of a flow which is not an api call (e.g. the api predicted for a
+        checkout). Events are kept out of the call counts and latencies.
+
+        :param tags: `MollieMetricTags` of the event
+        :param name: name of the event, stored as endpoint (e.g. `prediction.order`)
+    """
+    if not tags or not tags.dbname:
+        return
+    key = (tags.dbname, name, tags.tag or '', tags.caller or mollie_api_current_caller())
+    with _pending_lock:
+        values = _pending.setdefault(key, [0] * len(COUNTER_FIELDS))
+        values[-1] += 1
+        flush = time.monotonic() - _last_flush > FLUSH_INTERVAL
+    if flush:
+        mollie_flush_metrics()
+
+
+def mollie_flush_metrics():
+    """ Add the calls counted by this worker to the database. A dedicated cursor is used
+        so it can be called anywhere (threads, middle of a transaction).
+    """
+    global _last_flush
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+
+    rows_by_db = {}
+    for (dbname, endpoint, tag, caller), values in pending.items():
+        rows_by_db.setdefault(dbname, []).append((endpoint, tag, caller) + tuple(values))
+    query = """
+        INSERT INTO mollie_api_metric (endpoint, tag, caller, {fields}, create_uid, create_date, write_uid, write_date)
+        VALUES {values}
+        ON CONFLICT (endpoint, tag, caller) DO UPDATE SET {updates}, write_date = EXCLUDED.write_date
+    """
+    row_sql = "(%s, %s, %s, {counters}, {uid}, now() at time zone 'UTC', {uid}, now() at time zone 'UTC')".format(
+        counters=', '.join(['%s'] * len(COUNTER_FIELDS)), uid=SUPERUSER_ID)
+    for dbname, rows in rows_by_db.items():
+        try:
+            with sql_db.db_connect(dbname).cursor() as cr:
+                cr.execute(query.format(
+                    fields=', '.join(COUNTER_FIELDS),
+                    values=', '.join([row_sql] * len(rows)),
+                    updates=', '.join('{0} = mollie_api_metric.{0} + EXCLUDED.{0}'.format(field) for field in COUNTER_FIELDS),
+                ), [value for row in rows for value in row])
+        except Exception:
+            _logger.warning("Mollie: can not save api metrics of %s", dbname, exc_info=True)
+
+
+class MollieApiMetric(models.Model):
+    """ Totals of the calls made to mollie api per logical endpoint, acquirer or journal
+        (tag) and flow (caller). Rows are only updated with `mollie_flush_metrics`.
+    """
+    _name = 'mollie.api.metric'
+    _description = 'Mollie API metric'
+    _order = 'total_duration desc'
+
+    endpoint = fields.Char(required=True, readonly=True)
+    tag = fields.Char(required=True, readonly=True, default='', help="Acquirer or journal which made the calls")
+    caller = fields.Char(required=True, readonly=True, default='', help="Flow which made the calls")
+    call_count = fields.Integer(readonly=True)
+    error_count = fields.Integer(readonly=True)
+    retry_count = fields.Integer(readonly=True)
+    total_duration = fields.Float(string="Total Duration (s)", readonly=True)
+    avg_duration = fields.Float(string="Average Duration (s)", compute='_compute_avg_duration')
+    payload_size = fields.Float(string="Payload Size (bytes)", digits=(16, 0), readonly=True)
+    latency_100ms = fields.Integer(string="≤ 100ms", readonly=True)
+    latency_250ms = fields.Integer(string="≤ 250ms", readonly=True)
+    latency_500ms = fields.Integer(string="≤ 500ms", readonly=True)
+    latency_1s = fields.Integer(string="≤ 1s", readonly=True)
+    latency_2500ms = fields.Integer(string="≤ 2.5s", readonly=True)
+    latency_5s = fields.Integer(string="≤ 5s", readonly=True)
+    latency_10s = fields.Integer(string="≤ 10s", readonly=True)
+    event_count = fields.Integer(readonly=True, help="Events of the flow which are not api calls, e.g. api predicted for a checkout")
+
+    _sql_constraints = [
+        ('endpoint_tag_caller_uniq', 'unique(endpoint, tag, caller)', 'Metric already exists!'),
+    ]
+
+    @api.depends('total_duration', 'call_count')
+    def _compute_avg_duration(self):
+        for metric in self:
+            metric.avg_duration = metric.call_count and metric.total_duration / metric.call_count
+
+    @api.model
+    def _cron_flush_metrics(self):
+        mollie_flush_metrics()
+
+    @api.model
+    def _mollie_prometheus_metrics(self):
+        """ :return: all metrics in prometheus text format """
+        mollie_flush_metrics()
+
+        def format_labels(labels):
+            return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
+
+        metrics = self.sudo().search_read([], ['endpoint', 'tag', 'caller'] + list(COUNTER_FIELDS))
+        lines = []
+        # Events are not calls, they have no duration
+        calls = [metric for metric in metrics if metric['call_count']]
+        events = [metric for metric in metrics if metric['event_count']]
+        counters = [
+            ('mollie_api_calls_total', 'Mollie API calls', 'call_count', calls),
+            ('mollie_api_errors_total', 'Mollie API calls which failed', 'error_count', calls),
+            ('mollie_api_retries_total', 'Mollie API retries', 'retry_count', calls),
+            ('mollie_api_payload_bytes_total', 'Size of Mollie API responses', 'payload_size', calls),
+            ('mollie_api_events_total', 'Events of Mollie flows which are not API calls', 'event_count', events),
+        ]
+        for name, help_text, field, rows in counters:
+            lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s counter' % name]
+            for metric in rows:
+                lines.append('%s{%s} %s' % (name, format_labels([('endpoint', metric['endpoint']), ('tag', metric['tag']), ('caller', metric['caller'])]), int(metric[field])))
+
+        lines += ['# HELP mollie_api_duration_seconds Duration of Mollie API calls', '# TYPE mollie_api_duration_seconds histogram']
+        for metric in calls:
+            labels = [('endpoint', metric['endpoint']), ('tag', metric['tag']), ('caller', metric['caller'])]
+            cumulative = 0
+            for bound, field in zip(LATENCY_BUCKETS, LATENCY_FIELDS):
+                cumulative += metric[field]
+                lines.append('mollie_api_duration_seconds_bucket{%s} %s' % (format_labels(labels + [('le', bound)]), cumulative))
+            lines.append('mollie_api_duration_seconds_bucket{%s} %s' % (format_labels(labels + [('le', '+Inf')]), metric['call_count']))
+            lines.append('mollie_api_duration_seconds_sum{%s} %s' % (format_labels(labels), metric['total_duration']))
+            lines.append('mollie_api_duration_seconds_count{%s} %s' % (format_labels(labels), metric['call_count']))
+        return '\n'.join(lines) + '\n'
@@ -2,7 +2,7 @@
 
 import logging
 
-from odoo import _, api, fields, models
+from odoo import api, fields, models
 
 _logger = logging.getLogger(__name__)
 
@@ -29,3 +29,17 @@ class MolliePaymentMethod(models.Model):
     supports_payment_api = fields.Boolean()
 
     payment_issuer_ids = fields.Many2many('mollie.payment.method.issuer', string='Issuers')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        # Active methods are cached for the payment page
+        self.clear_caches()
+        return super().create(vals_list)
+
+    def write(self, vals):
+        self.clear_caches()
+        return super().write(vals)
+
+    def unlink(self):
+        self.clear_caches()
+        return super().unlink()
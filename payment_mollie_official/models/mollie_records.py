@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import dateutil.parser
+
+# dateutil and pytz don't recognize abbreviations PDT/PST
+TZINFOS = {"PST": -8 * 3600, "PDT": -7 * 3600}
+
+
+def parse_mollie_datetime(value):
+    """ Parse ISO-8601 dates of mollie api (any offset, `Z` and fractional seconds).
+
+        :return: naive UTC datetime, or None if value is empty
+    """
+    if not value:
+        return None
+    try:
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        date = datetime.fromisoformat(value)
+    except (AttributeError, ValueError):    # fromisoformat is python 3.7+ and strict
+        date = dateutil.parser.parse(value, tzinfos=TZINFOS)
+    if date.tzinfo:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def parse_mollie_amount(amount):
+    """ :return: Decimal value of a mollie amount object, or None """
+    if not amount:
+        return None
+    return Decimal(amount['value'])
+
+
+def mollie_payment_ref(metadata):
+    """ Reference of a payment built from its metadata: customer name and order reference """
+    metadata = metadata or {}
+    ref = ""
+    customer = metadata.get('customer')
+    if customer:
+        ref = ' '.join(name for name in (customer.get('firstName'), customer.get('lastName')) if name)
+    if metadata.get('reference'):
+        ref += (' #' if ref else '#') + metadata['reference']
+    return ref
+
+
+class MolliePayment(object):
+    """ Values of a mollie payment, decoded once from its json """
+    __slots__ = ('id', 'order_id', 'status', 'created_at', 'amount', 'currency', 'settlement_amount', 'description', 'reference', 'metadata')
+
+    def __init__(self, data):
+        amount = data.get('amount') or {}
+        self.id = data['id']
+        self.order_id = data.get('orderId')
+        self.status = data.get('status')
+        self.created_at = parse_mollie_datetime(data.get('createdAt'))
+        self.amount = parse_mollie_amount(amount)
+        self.currency = amount.get('currency')
+        self.settlement_amount = parse_mollie_amount(data.get('settlementAmount'))
+        self.description = data.get('description')
+        self.metadata = data.get('metadata')
+        self.reference = mollie_payment_ref(self.metadata)
+
+
+class MollieRefund(object):
+    """ Values of a mollie refund, decoded once from its json """
+    __slots__ = ('id', 'payment_id', 'status', 'created_at', 'settlement_amount', 'description', 'reference')
+
+    def __init__(self, data):
+        self.id = data['id']
+        self.payment_id = data.get('paymentId')
+        self.status = data.get('status')
+        self.created_at = parse_mollie_datetime(data.get('createdAt'))
+        self.settlement_amount = parse_mollie_amount(data.get('settlementAmount'))
+        self.description = data.get('description')
+        self.reference = mollie_payment_ref(data.get('metadata'))
+
+
+def decode_mollie_payments(records):
+    """ Generator of `MolliePayment` of json payments (e.g. streamed settlement payments) """
+    for data in records:
+        yield data if isinstance(data, MolliePayment) else MolliePayment(data)
+
+
+def decode_mollie_refunds(records):
+    """ Generator of `MollieRefund` of json refunds """
+    for data in records:
+        yield data if isinstance(data, MollieRefund) else MollieRefund(data)
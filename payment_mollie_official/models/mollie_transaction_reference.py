@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+from odoo import fields, models
+
+
+class MollieTransactionReference(models.Model):
+    _name = 'mollie.transaction.reference'
+    _description = 'Mollie transaction reference'
+
+    name = fields.Char(string="Mollie ID", required=True, index=True)
+    transaction_id = fields.Many2one('payment.transaction', required=True, ondelete='cascade', index=True)
+    reference_type = fields.Selection([('order', 'Order'), ('payment', 'Payment')])
+
+    _sql_constraints = [
+        ('name_transaction_uniq', 'unique(name, transaction_id)', 'Mollie ID must be unique per transaction!'),
+    ]
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+from .mollie_api_metric import mollie_api_caller
+
+_logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+KEEP_DAYS = 30
+MAX_ATTEMPTS = 6
+RETRY_DELAYS = (1, 5, 15, 60, 240)   # minutes before next attempt
+
+
+class MollieWebhookEvent(models.Model):
+    _name = 'mollie.webhook.event'
+    _description = 'Mollie webhook event'
+    _order = 'received_at, id'
+
+    transaction_id = fields.Many2one('payment.transaction', required=True, ondelete='cascade', index=True)
+    mollie_reference = fields.Char(required=True)
+    received_at = fields.Datetime(required=True, default=fields.Datetime.now)
+    processed_at = fields.Datetime()
+    lag = fields.Float(string="Lag (seconds)", group_operator='avg', help="Time between the reception of the webhook and its processing")
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('error', 'Error')
+    ], default='pending', required=True, index=True)
+    error_msg = fields.Text()
+    attempt_count = fields.Integer(string="Attempts", default=0)
+    next_attempt_at = fields.Datetime(string="Next Attempt", help="Failed events are retried from this time")
+
+    @api.model
+    def _cron_process_webhook_events(self, batch_size=BATCH_SIZE):
+        """ Drain the inbox batch by batch. Each batch is committed so a failure
+            later on does not replay the payments that are already validated.
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        while True:
+            events = self.search([
+                ('state', '=', 'pending'),
+                '|', ('next_attempt_at', '=', False), ('next_attempt_at', '<=', fields.Datetime.now())
+            ], limit=batch_size)
+            if not events:
+                break
+            events._process_webhook_events()
+            if auto_commit:
+                self.env.cr.commit()
+
+        # Wake up the cron for the first event waiting for a retry
+        next_retry = self.search([('state', '=', 'pending'), ('next_attempt_at', '!=', False)], order='next_attempt_at', limit=1)
+        if next_retry:
+            self.env.ref('payment_mollie_official.ir_cron_mollie_webhook_events')._trigger(next_retry.next_attempt_at)
+
+    @mollie_api_caller('webhook')
+    def _process_webhook_events(self):
+        """ Mollie sends a notification on every status change and retries them,
+            so notifications of the same payment are collapsed into one status fetch.
+        """
+        grouped_events = {}
+        for event in self:
+            key = (event.transaction_id, event.mollie_reference)
+            grouped_events.setdefault(key, self.browse())
+            grouped_events[key] |= event
+
+        PaymentTransaction = self.env['payment.transaction'].sudo()
+        for (transaction, mollie_reference), events in grouped_events.items():
+            vals = {'state': 'done', 'error_msg': False, 'next_attempt_at': False}
+            attempt_count = max(events.mapped('attempt_count')) + 1
+            try:
+                with self.env.cr.savepoint():
+                    # Reference may have changed since the webhook was received
+                    if transaction.acquirer_reference == mollie_reference:
+                        data = transaction.acquirer_id._mollie_get_payment_data(mollie_reference)
+                        PaymentTransaction.form_feedback(data, "mollie")
+            except Exception as e:
+                _logger.exception("Mollie: can not process webhook for %s (attempt %s)", mollie_reference, attempt_count)
+                # Mollie got its answer already, so failures (e.g. timeouts) are retried here
+                if attempt_count < MAX_ATTEMPTS:
+                    delay = RETRY_DELAYS[min(attempt_count, len(RETRY_DELAYS)) - 1]
+                    vals = {'state': 'pending', 'error_msg': str(e), 'next_attempt_at': fields.Datetime.now() + timedelta(minutes=delay)}
+                else:
+                    vals = {'state': 'error', 'error_msg': str(e), 'next_attempt_at': False}
+
+            processed_at = fields.Datetime.now()
+            for event in events:
+                event.write(dict(vals, attempt_count=attempt_count, processed_at=processed_at, lag=(processed_at - event.received_at).total_seconds()))
+
+    def action_retry(self):
+        self.write({'state': 'pending', 'error_msg': False, 'attempt_count': 0, 'next_attempt_at': False})
+        self.env.ref('payment_mollie_official.ir_cron_mollie_webhook_events')._trigger()
+
+    @api.autovacuum
+    def _gc_processed_events(self):
+        limit_date = fields.Datetime.now() - timedelta(days=KEEP_DAYS)
+        self.search([('state', '=', 'done'), ('processed_at', '<', limit_date)]).unlink()
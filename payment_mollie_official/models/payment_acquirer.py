@@ -1,20 +1,146 @@
 # -*- coding: utf-8 -*-
 
 import base64
+import hashlib
 import logging
 import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug import urls
 from mollie.api.client import Client as MollieClient
-from mollie.api.error import UnprocessableEntityError
+from mollie.api.error import RequestError, RequestSetupError, UnprocessableEntityError
+from mollie.api.resources.payment_refunds import PaymentRefunds
 
-from odoo import _, api, fields, models, service
+from odoo import _, api, fields, models, service, tools
 from odoo.exceptions import ValidationError
 from odoo.http import request
+from odoo.tools import float_compare
 
 from odoo.addons.payment_mollie_official.controllers.main import MollieController
+from odoo.addons.payment_mollie_official.models.mollie_api_metric import (
+    MollieMetricTags, mollie_api_caller, mollie_logical_endpoint, mollie_record_call, mollie_record_event)
 
 _logger = logging.getLogger(__name__)
 
+MOLLIE_API_ENDPOINT = 'https://api.mollie.com'
+ICON_FETCH_WORKERS = 8
+ICON_FETCH_TIMEOUT = 10
+
+
+def _mollie_fetch_image(image_url):
+    try:
+        response = requests.get(image_url, timeout=ICON_FETCH_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+    except requests.exceptions.RequestException as e:
+        _logger.warning("Mollie: can not download image %s: %s", image_url, e)
+        return False
+
+
+def _mollie_fetch_images(image_urls):
+    """ Download images on a bounded thread pool.
+
+        :param image_urls: iterable of image urls
+        :return: dict of image url and its content (False if download failed)
+    """
+    image_urls = list(image_urls)
+    if not image_urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(ICON_FETCH_WORKERS, len(image_urls))) as executor:
+        return dict(zip(image_urls, executor.map(_mollie_fetch_image, image_urls)))
+
+
+def _mollie_create_refund(mollie_client, transaction_reference, amount, currency_code, rate_limiter=None):
+    """ Refund the payment of a mollie order or payment. The payment embedded in the order
+        is used directly so only the order is fetched. It does not use the ORM so it can
+        be called from a thread.
+
+        :param rate_limiter: optional `MollieRateLimiter` shared by concurrent calls
+    """
+    payment_id = transaction_reference
+    if transaction_reference.startswith('ord_'):
+        if rate_limiter:
+            rate_limiter.wait()
+        order = mollie_client.orders.get(transaction_reference, embed="payments")
+        payments = order.get('_embedded', {}).get('payments', [])
+        # TODO: handle multiple payment for same order
+        payment_id = payments and payments[0]['id']
+        if not payment_id:
+            raise ValidationError(_("Mollie order %s does not have any payment to refund.") % transaction_reference)
+
+    if rate_limiter:
+        rate_limiter.wait()
+    # Client is shared between requests so don't use its stateful payment_refunds resource
+    return PaymentRefunds(mollie_client).with_parent_id(payment_id).create({
+        'amount': {
+            'value': "%.2f" % amount,
+            'currency': currency_code
+        }
+    })
+
+
+class MollieRateLimiter(object):
+    """ Space the calls made by several threads so at most `rate` calls start per second """
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next_call = 0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_call - now
+            self._next_call = max(now, self._next_call) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class MollieSessionClient(MollieClient):
+    """ Mollie client that sends all its calls through one HTTP session so
+        connections (and TLS handshakes) are kept alive between API calls.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._session = requests.Session()
+        self.metric_dbname = None
+        self.metric_tag = None
+
+    def _perform_http_call_apikey(self, http_method, path, data=None, params=None):
+        if not self.api_key:
+            raise RequestSetupError('You have not set an API key. Please use set_api_key() to set the API key.')
+        url, data, params = self._format_request_data(path, data, params)
+        start = time.monotonic()
+        response = None
+        try:
+            response = self._session.request(
+                http_method, url,
+                verify=True,
+                headers={
+                    'Accept': 'application/json',
+                    'Authorization': 'Bearer {api_key}'.format(api_key=self.api_key),
+                    'Content-Type': 'application/json',
+                    'User-Agent': self.user_agent,
+                    'X-Mollie-Client-Info': self.UNAME,
+                },
+                params=params,
+                data=data,
+                timeout=self.timeout,
+            )
+        except Exception as err:
+            raise RequestError('Unable to communicate with Mollie: {error}'.format(error=err))
+        finally:
+            mollie_record_call(
+                MollieMetricTags(self.metric_dbname, self.metric_tag, None),
+                mollie_logical_endpoint(http_method, url),
+                time.monotonic() - start,
+                size=len(response.content) if response is not None else 0,
+                error=response is None or response.status_code >= 400,
+            )
+        return response
+
 
 class PaymentAcquirerMollie(models.Model):
     _inherit = 'payment.acquirer'
@@ -25,95 +151,189 @@ class PaymentAcquirerMollie(models.Model):
     mollie_profile_id = fields.Char("Mollie Profile ID", groups="base.group_user")
     mollie_methods_ids = fields.One2many('mollie.payment.method', 'parent_id', string='Mollie Payment Methods')
 
+    def write(self, vals):
+        res = super().write(vals)
+        # Drop pooled clients built with old credentials
+        if {'state', 'mollie_api_key_test', 'mollie_api_key_prod'} & set(vals):
+            self.clear_caches()
+        return res
+
+    @mollie_api_caller('method_sync')
     def action_mollie_sync_methods(self):
         methods = self._api_mollie_get_active_payment_methods()
         if methods:
             self._sync_mollie_methods(methods)
 
     def _sync_mollie_methods(self, methods_dict):
+        """ Sync mollie methods and their issuers with the data received from the API.
+            Existing records are read once and only the changed values are written,
+            records needing the same values are written together.
+
+            :param methods_dict: dict of method code and method data from mollie
+        """
+        MolliePaymentMethod = self.env['mollie.payment.method']
+        MollieIssuer = self.env['mollie.payment.method.issuer']
 
         existing_methods = self.with_context(active_test=False).mollie_methods_ids
 
+        methods_by_vals = {}
         for method in existing_methods:
-            if method.method_id_code in methods_dict.keys():
+            if method.method_id_code in methods_dict:
                 # Update method
-                data = methods_dict[method.method_id_code]
-                method.write({
-                    'min_amount': data['minimumAmount'] and data['minimumAmount']['value'] or 0,
-                    'max_amount': data['maximumAmount'] and data['maximumAmount']['value'] or 0,
-                    'active': True,
-                    'supports_order_api': data.get('support_order_api', False),
-                    'supports_payment_api': data.get('support_payment_api', False)
-                })
+                vals = self._mollie_prepare_method_vals(methods_dict[method.method_id_code])
+                vals['active'] = True
             else:
                 # Deactivate Method
-                method.active = False
+                vals = {'active': False}
+            changed_vals = tuple(sorted((field, value) for field, value in vals.items() if method[field] != value))
+            if changed_vals:
+                methods_by_vals[changed_vals] = methods_by_vals.get(changed_vals, MolliePaymentMethod) | method
+        for vals, methods in methods_by_vals.items():
+            methods.write(dict(vals))
 
         # Create New methods
         methods_to_create = methods_dict.keys() - set(existing_methods.mapped('method_id_code'))
-        MolliePaymentMethod = self.env['mollie.payment.method']
+        if not methods_to_create:
+            return
+
+        # Fetch all the icons needed by new methods and issuers at once
+        icon_urls = {}
+        issuers_data = {}
         for method in methods_to_create:
             data = methods_dict[method]
+            icon_urls[data['description']] = data.get('image', {}).get('size2x')
+            for issuer_data in data.get('issuers') or []:
+                icon_urls[issuer_data['name']] = issuer_data.get('image', {}).get('size2x')
+                issuers_data[issuer_data['id']] = issuer_data
+        icons = self._mollie_get_payment_icons(icon_urls)
+
+        # Manage issuers for the methods
+        issuers = {}
+        for issuer in MollieIssuer.with_context(active_test=False).search([('issuers_id_code', 'in', list(issuers_data))]):
+            issuers.setdefault(issuer.issuers_id_code, issuer)
+        issuer_create_vals = []
+        for issuer_code, issuer_data in issuers_data.items():
+            if issuer_code in issuers:
+                continue
+            vals = {
+                'name': issuer_data['name'],
+                'issuers_id_code': issuer_code,
+            }
+            icon = icons.get(issuer_data['name'])
+            if icon:
+                vals['payment_icon_ids'] = [(6, 0, [icon.id])]
+            issuer_create_vals.append(vals)
+        for issuer in MollieIssuer.create(issuer_create_vals):
+            issuers[issuer.issuers_id_code] = issuer
 
-            create_vals = {
+        method_create_vals = []
+        for method in methods_to_create:
+            data = methods_dict[method]
+            create_vals = self._mollie_prepare_method_vals(data)
+            create_vals.update({
                 'name': data['description'],
                 'method_id_code': data['id'],
                 'parent_id': self.id,
-                'min_amount': data['minimumAmount'] and data['minimumAmount']['value'] or 0,
-                'max_amount': data['maximumAmount'] and data['maximumAmount']['value'] or 0,
-                'supports_order_api': data.get('support_order_api', False),
-                'supports_payment_api': data.get('support_payment_api', False)
-            }
+            })
 
-            # Manage issuer for the method
-            if data.get('issuers'):
-                issuer_ids = []
-                for issuer_data in data['issuers']:
-                    MollieIssuer = self.env['mollie.payment.method.issuer']
-                    issuer = MollieIssuer.search([('issuers_id_code', '=', issuer_data['id'])], limit=1)
-                    if not issuer:
-                        issuer_create_vals = {
-                            'name': issuer_data['name'],
-                            'issuers_id_code': issuer_data['id'],
-                        }
-                        icon = self.env['payment.icon'].search([('name', '=', issuer_data['name'])], limit=1)
-                        image_url = issuer_data.get('image', {}).get('size2x')
-                        if not icon and image_url:
-                            icon = self.env['payment.icon'].create({
-                                'name': issuer_data['name'],
-                                'image': base64.b64encode(requests.get(image_url).content)
-                            })
-                        issuer_create_vals['payment_icon_ids'] = [(6, 0, [icon.id])]
-                        issuer = MollieIssuer.create(issuer_create_vals)
-                    issuer_ids.append(issuer.id)
-                if issuer_ids:
-                    create_vals['payment_issuer_ids'] = [(6, 0, issuer_ids)]
+            issuer_ids = [issuers[issuer_data['id']].id for issuer_data in data.get('issuers') or []]
+            if issuer_ids:
+                create_vals['payment_issuer_ids'] = [(6, 0, issuer_ids)]
 
             # Manage icon for method
-            icon = self.env['payment.icon'].search([('name', '=', data['description'])], limit=1)
-            image_url = data.get('image', {}).get('size2x')
-            if not icon and image_url:
-                icon = self.env['payment.icon'].create({
-                    'name': data['description'],
-                    'image': base64.b64encode(requests.get(image_url).content)
-                })
+            icon = icons.get(data['description'])
             if icon:
                 create_vals['payment_icon_ids'] = [(6, 0, [icon.id])]
 
-            MolliePaymentMethod.create(create_vals)
+            method_create_vals.append(create_vals)
+        MolliePaymentMethod.create(method_create_vals)
+
+    def _mollie_prepare_method_vals(self, data):
+        return {
+            'min_amount': float(data['minimumAmount'] and data['minimumAmount']['value'] or 0),
+            'max_amount': float(data['maximumAmount'] and data['maximumAmount']['value'] or 0),
+            'supports_order_api': data.get('support_order_api', False),
+            'supports_payment_api': data.get('support_payment_api', False)
+        }
+
+    def _mollie_get_payment_icons(self, icon_urls):
+        """ Find or create the payment icons by name. Missing images are downloaded
+            in parallel and an image already stored in another icon is reused.
+
+            :param icon_urls: dict of icon name and image url
+            :return: dict of icon name and payment.icon record
+        """
+        PaymentIcon = self.env['payment.icon']
+        icons_by_name = {}
+        for icon_data in PaymentIcon.search_read([], ['name']):
+            icons_by_name.setdefault(icon_data['name'], PaymentIcon.browse(icon_data['id']))
+
+        icons_by_checksum = {}
+        icon_attachments = self.env['ir.attachment'].sudo().search_read([
+            ('res_model', '=', 'payment.icon'),
+            ('res_field', '=', 'image'),
+            ('res_id', '!=', False)
+        ], ['res_id', 'checksum'])
+        for attachment in icon_attachments:
+            icons_by_checksum.setdefault(attachment['checksum'], PaymentIcon.browse(attachment['res_id']))
+
+        urls_to_fetch = {name: url for name, url in icon_urls.items() if url and name not in icons_by_name}
+        images = _mollie_fetch_images(set(urls_to_fetch.values()))
+
+        names_by_checksum = {}
+        for name, url in urls_to_fetch.items():
+            if not images.get(url):
+                continue
+            checksum = hashlib.sha1(images[url]).hexdigest()
+            if checksum in icons_by_checksum:
+                icons_by_name[name] = icons_by_checksum[checksum]
+            else:
+                names_by_checksum.setdefault(checksum, (url, []))[1].append(name)
+
+        icon_vals = [{
+            'name': names[0],
+            'image': base64.b64encode(images[url])
+        } for url, names in names_by_checksum.values()]
+        for icon, (url, names) in zip(PaymentIcon.create(icon_vals), names_by_checksum.values()):
+            for name in names:
+                icons_by_name[name] = icon
+
+        return {name: icons_by_name[name] for name in icon_urls if name in icons_by_name}
 
     def mollie_get_active_methods(self, order=None):
         # TODO: [PGA] Check currency is supported. Hard coded filter can be applied based on https://docs.mollie.com/payments/multicurrency
-        methods = self.mollie_methods_ids.filtered(lambda m: m.active and m.active_on_shop)
-
-        # Hide methods if order amount is higher then method limits
+        amount = None
         if order and order._name == 'sale.order':
-            methods = methods.filtered(lambda m: order.amount_total >= m.min_amount and (order.amount_total <= m.max_amount or not m.max_amount))
+            amount = order.amount_total
         if order and order._name == 'account.move':
-            methods = methods.filtered(lambda m: order.amount_residual >= m.min_amount and (order.amount_residual <= m.max_amount or not m.max_amount))
+            amount = order.amount_residual
 
-        return methods
+        # Hide methods if order amount is higher then method limits
+        methods = []
+        for method_id, position, min_amount, max_amount in self._mollie_get_active_method_ranges():
+            if amount is not None:
+                if amount < min_amount:
+                    break    # Ranges are sorted by min amount
+                if max_amount and amount > max_amount:
+                    continue
+            methods.append((position, method_id))
+
+        return self.env['mollie.payment.method'].browse([method_id for position, method_id in sorted(methods)])
+
+    @tools.ormcache('self.id')
+    def _mollie_get_active_method_ranges(self):
+        """ Amount ranges of the methods enabled on shop, sorted by min amount.
+            Rendered on every payment page so it is cached per worker, it is
+            cleared whenever the mollie methods are changed.
+
+            :return: tuple of (method_id, position, min_amount, max_amount), position
+                     is the index of the method in the displayed order
+        """
+        methods = self.env['mollie.payment.method'].sudo().search([('parent_id', '=', self.id), ('active_on_shop', '=', True)])
+        ranges = [(method.id, position, method.min_amount, method.max_amount) for position, method in enumerate(methods)]
+        return tuple(sorted(ranges, key=lambda r: (r[2], r[1])))
 
+    @mollie_api_caller('checkout')
     def mollie_form_generate_values(self, tx_values):
         self.ensure_one()
         tx_reference = tx_values.get('reference')
@@ -129,17 +349,23 @@ class PaymentAcquirerMollie(models.Model):
         tx_values['error_msg'] = False
         tx_values['status'] = False
         if transaction:
-            result = self._mollie_create_order(transaction)
-
-            # Fallback to payment method
-            # Case: When invoice is partially paid or partner have credit note
-            # then mollie can not create order because orderline and total amount is diffrent
-            # in that case we have fall back on payment method
-            if result and result.get('error'):
-                method_record = self._mollie_get_method_record(transaction.mollie_payment_method)
-                if method_record.supports_payment_api:
-                    _logger.warning("Can not use order api due to '%s' fallback on payment" % result.get('error'))
+            method_record = self._mollie_get_method_record(transaction.mollie_payment_method)
+            order_data = False
+            # Order payload is not built for methods which only work with payment api
+            if not method_record or method_record.supports_order_api or not method_record.supports_payment_api:
+                order_data = self._mollie_prepare_order_data(transaction)
+
+            if self._mollie_use_order_api(transaction, order_data, method_record):
+                result = self._mollie_create_order(transaction, order_data)
+
+                # Fallback to payment method
+                # Case: prediction was wrong and mollie refused the order
+                if result.get('error') and method_record.supports_payment_api:
+                    self._mollie_record_prediction('order_missed')
+                    _logger.warning("Can not use order api due to '%s' fallback on payment", result.get('error'))
                     result = self._mollie_create_payment(transaction)
+            else:
+                result = self._mollie_create_payment(transaction)
 
             if result.get('error'):
                 tx_values['error_msg'] = result['error']
@@ -156,7 +382,57 @@ class PaymentAcquirerMollie(models.Model):
     def mollie_get_form_action_url(self):
         return "/payment/mollie/action"
 
-    def _mollie_create_order(self, transaction):
+    def _mollie_use_order_api(self, transaction, order_data, method_record):
+        """ Predict if mollie will accept the order so the right api is called directly.
+            Case: When invoice is partially paid or partner have credit note
+            then mollie can not create order because orderline and total amount is diffrent
+            in that case we have to use payment api.
+
+            :param order_data: order payload prepared for the transaction (False if no order)
+            :param method_record: mollie method selected for the transaction
+            :return: True if order api should be used
+        """
+        if not order_data or not order_data['lines']:
+            use_order_api = False
+        elif method_record and not method_record.supports_payment_api:
+            use_order_api = True    # Order only methods (e.g. klarna), let mollie return the error
+        elif method_record and not method_record.supports_order_api:
+            use_order_api = False
+        else:
+            use_order_api = True
+            lines_total = 0.0
+            for line in order_data['lines']:
+                line_total = float(line['totalAmount']['value'])
+                if float_compare(float(line['unitPrice']['value']) * line['quantity'], line_total, precision_digits=2) != 0:
+                    use_order_api = False    # Quantity is rounded for mollie
+                lines_total += line_total
+            if float_compare(lines_total, transaction.amount, precision_digits=2) != 0:
+                use_order_api = False
+
+        self._mollie_record_prediction('order' if use_order_api else 'payment')
+        return use_order_api
+
+    def _mollie_record_prediction(self, prediction):
+        """ Count the api chosen for a checkout (or a missed order prediction) as metric events,
+            the miss rate is `prediction.order_missed` events over `prediction.order` events.
+        """
+        mollie_record_event(MollieMetricTags(self.env.cr.dbname, 'acquirer:%s' % self.id, None), 'prediction.%s' % prediction)
+
+    def _mollie_create_order(self, transaction, payment_data=None):
+        if payment_data is None:
+            payment_data = self._mollie_prepare_order_data(transaction)
+        if not payment_data:
+            return False
+
+        result = self._api_mollie_create_order(payment_data)
+
+        # We are setting acquirer reference as we are receiving it before 3DS payment
+        # So we can identify transaction with mollie respose
+        if result and result.get('id'):
+            transaction.acquirer_reference = result.get('id')
+        return result
+
+    def _mollie_prepare_order_data(self, transaction):
         order_source = False
         if transaction.invoice_ids:
             order_source = transaction.invoice_ids[0]
@@ -206,13 +482,7 @@ class PaymentAcquirerMollie(models.Model):
         if transaction.mollie_payment_issuer:
             payment_data['payment'] = {'issuer': transaction.mollie_payment_issuer}
 
-        result = self._api_mollie_create_order(payment_data)
-
-        # We are setting acquirer reference as we are receiving it before 3DS payment
-        # So we can identify transaction with mollie respose
-        if result and result.get('id'):
-            transaction.acquirer_reference = result.get('id')
-        return result
+        return payment_data
 
     def _mollie_create_payment(self, transaction):
         """ This method is used as fallback. When order method fails. """
@@ -265,13 +535,32 @@ class PaymentAcquirerMollie(models.Model):
     # -----------------------------------------------
 
     def _api_mollie_get_client(self):
-        mollie_client = MollieClient()
         # TODO: [PGA] Add partical validation for keys e.g. production key should start from live_
-
+        api_key = False
         if self.state == 'enabled':
-            mollie_client.set_api_key(self.mollie_api_key_prod)
+            api_key = self.mollie_api_key_prod
         elif self.state == 'test':
-            mollie_client.set_api_key(self.mollie_api_key_test)
+            api_key = self.mollie_api_key_test
+        key_hash = api_key and hashlib.sha256(api_key.encode()).hexdigest()
+        return self._api_mollie_get_cached_client(self.id, self.state, key_hash, api_key, self._mollie_get_api_endpoint())
+
+    @api.model
+    def _mollie_get_api_endpoint(self):
+        """ Mollie API can be replaced (e.g. by a local stand-in to measure the flows)
+            with the `payment_mollie_official.api_endpoint` system parameter.
+        """
+        return self.env['ir.config_parameter'].sudo().get_param('payment_mollie_official.api_endpoint') or MOLLIE_API_ENDPOINT
+
+    @tools.ormcache('acquirer_id', 'state', 'key_hash', 'api_endpoint')
+    def _api_mollie_get_cached_client(self, acquirer_id, state, key_hash, api_key, api_endpoint):
+        """ Build the mollie client once per worker and credentials. The client is
+            reused by all the calls so the HTTP connection is kept alive.
+        """
+        mollie_client = MollieSessionClient(api_endpoint=api_endpoint)
+        mollie_client.metric_dbname = self.env.cr.dbname
+        mollie_client.metric_tag = 'acquirer:%s' % acquirer_id
+        if api_key:
+            mollie_client.set_api_key(api_key)
 
         mollie_client.set_user_agent_component('Odoo', service.common.exp_version()['server_version'])
         mollie_client.set_user_agent_component('MollieOdoo', self.env.ref('base.module_payment_mollie_official').installed_version)
@@ -325,25 +614,7 @@ class PaymentAcquirerMollie(models.Model):
         return result
 
     def _api_mollie_refund(self, amount, currency, transection_reference):
-        payment_record = self._mollie_get_payment_data(transection_reference)
-        transection_id = False
-        if payment_record['resource'] == 'order':
-            payments = payment_record.get('_embedded', {}).get('payments', [])
-            if payments:
-                # TODO: handle multiple payment for same order
-                transection_id = payments[0]['id']
-        elif payment_record['resource'] == 'payment':
-            transection_id = payment_record['id']
-
-        mollie_client = self._api_mollie_get_client()
-        payment_rec = mollie_client.payments.get(transection_id)
-        refund = mollie_client.payment_refunds.on(payment_rec).create({
-            'amount': {
-                'value': "%.2f" % amount,
-                'currency': currency.name
-            }
-        })
-        return refund
+        return _mollie_create_refund(self._api_mollie_get_client(), transection_reference, amount, currency.name)
 
     # -----------------------------------------------
     # Methods that create mollie order payload
@@ -361,8 +632,8 @@ class PaymentAcquirerMollie(models.Model):
 
     def _mollie_prepare_so_lines(self, lines):
         result = []
-        for line in lines:
-            line_data = self._mollie_prepare_lines_common(line)
+        tax_rates = self._mollie_get_tax_rates(lines.mapped('tax_id'))
+        for line, line_data in zip(lines, self._mollie_prepare_lines_common(lines)):
             line_data.update({
                 'quantity': int(line.product_uom_qty),    # TODO: Mollie does not support float. Test with float amount
                 'unitPrice': {
@@ -373,7 +644,7 @@ class PaymentAcquirerMollie(models.Model):
                     'currency': line.currency_id.name,
                     'value': "%.2f" % line.price_total,
                 },
-                'vatRate': "%.2f" % sum(line.tax_id.mapped('amount')),
+                'vatRate': "%.2f" % sum(tax_rates[tax_id] for tax_id in line.tax_id.ids),
                 'vatAmount': {
                     'currency': line.currency_id.name,
                     'value': "%.2f" % line.price_tax,
@@ -398,8 +669,8 @@ class PaymentAcquirerMollie(models.Model):
                 vatAmount = total_price_tax_included - total_price_tax_excluded
         """
         result = []
-        for line in lines:
-            line_data = self._mollie_prepare_lines_common(line)
+        tax_rates = self._mollie_get_tax_rates(lines.mapped('tax_ids'))
+        for line, line_data in zip(lines, self._mollie_prepare_lines_common(lines)):
             line_data.update({
                 'quantity': int(line.quantity),    # TODO: Mollie does not support float. Test with float amount
                 'unitPrice': {
@@ -410,7 +681,7 @@ class PaymentAcquirerMollie(models.Model):
                     'currency': line.always_set_currency_id.name,
                     'value': "%.2f" % line.price_total,
                 },
-                'vatRate': "%.2f" % sum(line.tax_ids.mapped('amount')),
+                'vatRate': "%.2f" % sum(tax_rates[tax_id] for tax_id in line.tax_ids.ids),
                 'vatAmount': {
                     'currency': line.always_set_currency_id.name,
                     'value': "%.2f" % (line.price_total - line.price_subtotal),
@@ -419,24 +690,42 @@ class PaymentAcquirerMollie(models.Model):
             result.append(line_data)
         return result
 
-    def _mollie_prepare_lines_common(self, line):
+    def _mollie_prepare_lines_common(self, lines):
+        """ Prepare the product part of the order lines. Lines are processed in batch
+            so products urls are computed at once and base url is resolved only once.
 
-        product_data = {
-            'name': line.name,
-            "type": "physical",
-        }
+            :param lines: sale order lines or invoice lines
+            :return: list of product data in the same order as the lines
+        """
+        result = []
+        base_url = self.get_base_url()
+        has_delivery = 'is_delivery' in lines._fields
+
+        product_urls = {}
+        if 'website_url' in self.env['product.product']._fields:
+            products = lines.mapped('product_id')
+            product_urls = dict(zip(products.ids, products.mapped('website_url')))
+
+        for line in lines:
+            product_data = {
+                'name': line.name,
+                "type": "physical",
+            }
 
-        if line.product_id.type == 'service':
-            product_data['type'] = 'digital'  # We are considering service product as digital as we don't do shipping for it.
+            if line.product_id.type == 'service':
+                product_data['type'] = 'digital'  # We are considering service product as digital as we don't do shipping for it.
 
-        if 'is_delivery' in line._fields and line.is_delivery:
-            product_data['type'] = 'shipping_fee'
+            if has_delivery and line.is_delivery:
+                product_data['type'] = 'shipping_fee'
 
-        if line.product_id and 'website_url' in line.product_id._fields:
-            base_url = self.get_base_url()
-            product_data['productUrl'] = urls.url_join(base_url, line.product_id.website_url)
+            if line.product_id.id in product_urls:
+                product_data['productUrl'] = urls.url_join(base_url, product_urls[line.product_id.id])
+
+            result.append(product_data)
+        return result
 
-        return product_data
+    def _mollie_get_tax_rates(self, taxes):
+        return dict(zip(taxes.ids, taxes.mapped('amount')))
 
     # -----------------------------------------------
     # Helper methods for mollie
@@ -1,25 +1,29 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import pytz
-import dateutil.parser
+
+from psycopg2 import errorcodes, IntegrityError
 
 from odoo import http
 from odoo.http import request
 from odoo.exceptions import ValidationError
-from odoo.tools import float_is_zero, float_compare
+from odoo.tools import float_is_zero, float_compare, mute_logger
 
 from odoo import _, api, fields, models
 
+from .mollie_records import parse_mollie_datetime
+
 _logger = logging.getLogger(__name__)
 
 
 class PaymentTransaction(models.Model):
     _inherit = 'payment.transaction'
 
+    acquirer_reference = fields.Char(index=True)    # Used to find transaction from mollie ids (ord_ and tr_)
     mollie_payment_token = fields.Char()
     mollie_payment_method = fields.Char()
     mollie_payment_issuer = fields.Char()
+    mollie_reference_ids = fields.One2many('mollie.transaction.reference', 'transaction_id')
 
     def mollie_create(self, vals):
         create_vals = {}
@@ -35,11 +39,29 @@ class PaymentTransaction(models.Model):
 
         return create_vals
 
+    @api.model
+    def _mollie_get_tx_from_references(self, references):
+        """ Find mollie transactions of one or many mollie references in one query.
+
+            :param references: list of mollie ids (ord_ and tr_)
+            :return: dict of mollie reference and transactions (recordset)
+        """
+        result = {}
+        references = list(references)
+        transactions = self.search([('acquirer_reference', 'in', references), ('acquirer_id.provider', '=', 'mollie')])
+        for transaction in transactions:
+            result[transaction.acquirer_reference] = result.get(transaction.acquirer_reference, self.browse()) | transaction
+
+        # Payments of mollie orders are only known through their order
+        for mollie_reference in self.env['mollie.transaction.reference'].search([('name', 'in', references)]):
+            result[mollie_reference.name] = result.get(mollie_reference.name, self.browse()) | mollie_reference.transaction_id
+        return result
+
     def _mollie_form_get_tx_from_data(self, data):
         acquirer_reference = data.get("id")
-        transaction = self.search([("acquirer_reference", "=", acquirer_reference)])
+        transaction = self._mollie_get_tx_from_references([acquirer_reference]).get(acquirer_reference, self.browse())
         if len(transaction) != 1:
-            error_msg = _("Mollie:received response for reference %s") % (transaction.reference)
+            error_msg = _("Mollie:received response for reference %s") % (acquirer_reference)
             if not transaction:
                 error_msg += _(": no order found")
             else:
@@ -73,6 +95,7 @@ class PaymentTransaction(models.Model):
 
         # TODO: [PGA] check this is need or not
         mollie_payment = self.acquirer_id._mollie_get_payment_data(acquirer_reference)
+        self._mollie_store_references(mollie_payment)
 
         # Validate through order via its sub payment object as it has valid error messages
         # and state We are assuming it will have only one payment as we are createing new order
@@ -83,10 +106,7 @@ class PaymentTransaction(models.Model):
                 mollie_payment = payment_list[0]
 
         try:
-            # dateutil and pytz don't recognize abbreviations PDT/PST
-            tzinfos = {"PST": -8 * 3600, "PDT": -7 * 3600}
-            validation_date = dateutil.parser.parse(data.get('createdAt'), tzinfos=tzinfos).astimezone(pytz.utc).replace(tzinfo=None)
-
+            validation_date = parse_mollie_datetime(data.get('createdAt')) or fields.Datetime.now()
         except Exception:
             validation_date = fields.Datetime.now()
 
@@ -104,6 +124,32 @@ class PaymentTransaction(models.Model):
 
         return True
 
+    def _mollie_store_references(self, mollie_data):
+        """ Link the mollie order and its payments with the transaction so settlement
+            lines (which only contain payment ids) can find the transaction.
+            Customer return and webhook can validate the transaction at the same time,
+            so references stored meanwhile by the other one are ignored.
+        """
+        references = {mollie_data['id']: mollie_data.get('resource')}
+        for payment in mollie_data.get('_embedded', {}).get('payments', []):
+            references[payment['id']] = 'payment'
+        existing_references = set(self.mollie_reference_ids.mapped('name'))
+        MollieReference = self.env['mollie.transaction.reference'].sudo()
+        for mollie_id, reference_type in references.items():
+            if mollie_id in existing_references:
+                continue
+            try:
+                with mute_logger('odoo.sql_db'), self.env.cr.savepoint():
+                    MollieReference.create({
+                        'name': mollie_id,
+                        'transaction_id': self.id,
+                        'reference_type': reference_type,
+                    })
+            except IntegrityError as e:
+                if e.pgcode != errorcodes.UNIQUE_VIOLATION:
+                    raise
+        self.invalidate_cache(['mollie_reference_ids'])
+
     def _create_payment(self, add_payment_vals={}):
         """ Set diffrent journal based on payment method"""
         add_payment_vals = add_payment_vals or {}
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+from . import test_mollie_checkout
+from . import test_mollie_benchmark
+from . import test_mollie_methods
+from . import test_mollie_order_lines
+from . import test_mollie_records
+from . import test_mollie_webhook
@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+_logger = logging.getLogger(__name__)
+
+MOLLIE_TEST_API_KEY = 'test_' + 'x' * 30
+MOLLIE_PAGE_SIZE = 50
+MOLLIE_MAX_PAGE_SIZE = 250
+
+
+def _method_payload(method_id, description, minimum, maximum, issuers=None):
+    data = {
+        'resource': 'method',
+        'id': method_id,
+        'description': description,
+        'minimumAmount': {'value': minimum, 'currency': 'EUR'},
+        'maximumAmount': maximum and {'value': maximum, 'currency': 'EUR'},
+        'image': {
+            'size1x': 'https://www.mollie.com/external/icons/payment-methods/%s.png' % method_id,
+            'size2x': 'https://www.mollie.com/external/icons/payment-methods/%s%%402x.png' % method_id,
+            'svg': 'https://www.mollie.com/external/icons/payment-methods/%s.svg' % method_id,
+        },
+        'status': 'activated',
+    }
+    if issuers is not None:
+        data['issuers'] = [{
+            'resource': 'issuer',
+            'id': issuer_id,
+            'name': name,
+            'image': {
+                'size1x': 'https://www.mollie.com/external/icons/ideal-issuers/%s.png' % issuer_id,
+                'size2x': 'https://www.mollie.com/external/icons/ideal-issuers/%s%%402x.png' % issuer_id,
+            },
+        } for issuer_id, name in issuers]
+    return data
+
+
+# Methods of a test account as returned by `GET /v2/methods` (with `resource=orders&include=issuers`
+# for the orders one). Klarna is only available on the order api, bank transfer only on payments.
+MOLLIE_IDEAL_ISSUERS = [('ideal_ABNANL2A', 'ABN AMRO'), ('ideal_INGBNL2A', 'ING'), ('ideal_RABONL2U', 'Rabobank')]
+MOLLIE_ORDER_METHODS = [
+    _method_payload('ideal', 'iDEAL', '0.01', '50000.00', MOLLIE_IDEAL_ISSUERS),
+    _method_payload('creditcard', 'Credit card', '0.01', '10000.00'),
+    _method_payload('bancontact', 'Bancontact', '0.02', '50000.00'),
+    _method_payload('kbc', 'KBC/CBC Payment Button', '0.01', '50000.00', [('kbc', 'KBC'), ('cbc', 'CBC')]),
+    _method_payload('klarnapaylater', 'Pay later.', '0.01', '2000.00'),
+]
+MOLLIE_PAYMENT_METHODS = [
+    _method_payload('ideal', 'iDEAL', '0.01', '50000.00'),
+    _method_payload('creditcard', 'Credit card', '0.01', '10000.00'),
+    _method_payload('bancontact', 'Bancontact', '0.02', '50000.00'),
+    _method_payload('kbc', 'KBC/CBC Payment Button', '0.01', '50000.00'),
+    _method_payload('banktransfer', 'Bank transfer', '0.01', '1000000.00'),
+]
+
+
+def mollie_amount(value, currency='EUR'):
+    return {'value': '%.2f' % value, 'currency': currency}
+
+
+def _mollie_now():
+    return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+
+
+class _MollieRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'    # Keep alive, like mollie
+    server_version = 'MollieFakeServer'
+    fake = None
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = json.loads(self.rfile.read(length)) if length else None
+        status, payload, headers = self.fake.dispatch(self.command, self.path, data)
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/hal+json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MollieFakeServer(object):
+    """ Local stand-in of mollie api v2 to exercise the api flows without network:
+        methods, orders, payments, refunds and settlements (with their payments and
+        refunds). Lists are paginated with `_links.next` like mollie.
+
+        :param latency: seconds added to every response
+        :param rate_limit_every: every nth request is answered with a 429
+        :param page_size: page size of lists when no `limit` is given
+    """
+
+    def __init__(self, latency=0, rate_limit_every=0, page_size=MOLLIE_PAGE_SIZE):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.page_size = page_size
+        self.order_methods = list(MOLLIE_ORDER_METHODS)
+        self.payment_methods = list(MOLLIE_PAYMENT_METHODS)
+        self.orders = {}
+        self.payments = {}
+        self.refunds = {}
+        self.settlements = []
+        self.settlement_payments = {}
+        self.settlement_refunds = {}
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self.requests = []
+        self._positions = {}
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self._httpd.server_port
+
+    def start(self):
+        handler = type('MollieRequestHandler', (_MollieRequestHandler,), {'fake': self})
+        self._httpd = _ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='mollie-fake-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+
+    def clear_settlements(self):
+        """ Remove the settlements of the account, e.g. between the tests of a class """
+        with self._lock:
+            self.settlements = []
+            self.settlement_payments.clear()
+            self.settlement_refunds.clear()
+            self._positions.clear()
+
+    def count_requests(self, http_method=None, path=None):
+        """ :return: number of requests received (429 included), filtered by method and path prefix """
+        return len([1 for method, request_path in self.requests
+                    if (not http_method or method == http_method) and (not path or request_path.startswith(path))])
+
+    # -----------------------------------------------
+    # Data of the fake account
+    # -----------------------------------------------
+
+    def _new_id(self, prefix):
+        return '%s_%06d' % (prefix, next(self._sequence))
+
+    def _new_payment(self, amount, status='open', order_id=None, **values):
+        payment = dict({
+            'resource': 'payment',
+            'id': self._new_id('tr'),
+            'mode': 'test',
+            'status': status,
+            'amount': amount,
+            'createdAt': _mollie_now(),
+        }, **values)
+        if order_id:
+            payment['orderId'] = order_id
+        payment['_links'] = {'checkout': {'href': '%s/checkout/%s' % (self.url, payment['id'])}}
+        self.payments[payment['id']] = payment
+        return payment
+
+    def add_order(self, amount, currency='EUR', status='paid', lines=None):
+        """ Add an order (and its payment) to the account, e.g. to send its webhook
+
+            :return: order data
+        """
+        order = {
+            'resource': 'order',
+            'id': self._new_id('ord'),
+            'mode': 'test',
+            'status': status,
+            'amount': mollie_amount(amount, currency),
+            'lines': lines or [],
+            'createdAt': _mollie_now(),
+            'payment_ids': [],
+        }
+        order['_links'] = {'checkout': {'href': '%s/checkout/%s' % (self.url, order['id'])}}
+        payment = self._new_payment(order['amount'], status=status, order_id=order['id'])
+        order['payment_ids'].append(payment['id'])
+        self.orders[order['id']] = order
+        return self._order_payload(order, embed_payments=False)
+
+    def set_status(self, mollie_id, status):
+        """ Change the status of an order and its payments, or of a payment """
+        if mollie_id in self.orders:
+            self.orders[mollie_id]['status'] = status
+            for payment_id in self.orders[mollie_id]['payment_ids']:
+                self.payments[payment_id]['status'] = status
+        else:
+            self.payments[mollie_id]['status'] = status
+
+    def add_settlement(self, payments_count, refunds_count=0, payment_amount=10.0, refund_amount=-5.0, fee_amount=0.29):
+        """ Add a paid out settlement with generated payments, refunds and fees (newest first in lists)
+
+            :return: settlement data
+        """
+        settlement_id = self._new_id('stl')
+        created_at = _mollie_now()
+        payments = [{
+            'resource': 'payment',
+            'id': '%s_tr_%s' % (settlement_id, index),
+            'mode': 'live',
+            'status': 'paid',
+            'createdAt': created_at,
+            'amount': mollie_amount(payment_amount),
+            'settlementAmount': mollie_amount(payment_amount),
+            'description': 'Payment %s' % index,
+            'method': 'ideal',
+            'orderId': '%s_ord_%s' % (settlement_id, index),
+            'metadata': {'reference': 'S%05d' % index, 'customer': {'firstName': 'Customer', 'lastName': str(index)}},
+            'settlementId': settlement_id,
+        } for index in range(payments_count)]
+        refunds = [{
+            'resource': 'refund',
+            'id': '%s_re_%s' % (settlement_id, index),
+            'status': 'refunded',
+            'createdAt': created_at,
+            'amount': mollie_amount(-refund_amount),
+            'settlementAmount': mollie_amount(refund_amount),
+            'description': 'Refund %s' % index,
+            'paymentId': '%s_tr_%s' % (settlement_id, index),
+            'settlementId': settlement_id,
+        } for index in range(refunds_count)]
+        fees = Decimal('%.2f' % fee_amount) * payments_count
+        total = Decimal('%.2f' % payment_amount) * payments_count + Decimal('%.2f' % refund_amount) * refunds_count - fees
+        now = datetime.now(timezone.utc)
+        settlement = {
+            'resource': 'settlement',
+            'id': settlement_id,
+            'reference': '%s.%s' % (now.strftime('%Y%m%d'), settlement_id),
+            'createdAt': created_at,
+            'settledAt': created_at,
+            'status': 'paidout',
+            'amount': mollie_amount(total),
+            'periods': {
+                str(now.year): {
+                    '%02d' % now.month: {
+                        'revenue': [],
+                        'costs': [{
+                            'description': 'iDEAL',
+                            'method': 'ideal',
+                            'count': payments_count,
+                            'rate': {'fixed': mollie_amount(fee_amount)},
+                            'amountNet': mollie_amount(fees),
+                            'amountVat': None,
+                            'amountGross': mollie_amount(fees),
+                        }] if payments_count else [],
+                    }
+                }
+            },
+        }
+        self.settlements.insert(0, settlement)
+        self.settlement_payments[settlement_id] = payments
+        self.settlement_refunds[settlement_id] = refunds
+        return settlement
+
+    # -----------------------------------------------
+    # Requests
+    # -----------------------------------------------
+
+    def dispatch(self, http_method, path, data=None):
+        """ :return: tuple of (status, json payload, extra headers) """
+        url = urlparse(path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        with self._lock:
+            self.request_count += 1
+            self.requests.append((http_method, url.path))
+            rate_limited = self.rate_limit_every and self.request_count % self.rate_limit_every == 0
+            if rate_limited:
+                self.rate_limited_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if rate_limited:
+            return 429, self._error(429, 'Too Many Requests', 'You have exceeded the rate limit.'), {'Retry-After': '0'}
+
+        segments = [segment for segment in url.path.split('/') if segment][1:]   # without api version
+        try:
+            with self._lock:
+                return self._route(http_method, segments, query, data, url.path) + ({},)
+        except KeyError:
+            return 404, self._error(404, 'Not Found', 'No resource found at %s' % url.path), {}
+
+    def _route(self, http_method, segments, query, data, path):
+        resource, size = segments[0], len(segments)
+        if resource == 'methods' and size == 1 and http_method == 'GET':
+            methods = self.order_methods if query.get('resource') == 'orders' else self.payment_methods
+            if query.get('include') != 'issuers':
+                methods = [{key: value for key, value in method.items() if key != 'issuers'} for method in methods]
+            return 200, {'count': len(methods), '_embedded': {'methods': methods}, '_links': {'next': None, 'previous': None}}
+        if resource == 'orders' and size == 1 and http_method == 'POST':
+            return self._create_order(data)
+        if resource == 'orders' and size == 2 and http_method == 'GET':
+            return 200, self._order_payload(self.orders[segments[1]], embed_payments='payments' in query.get('embed', ''))
+        if resource == 'payments' and size == 1 and http_method == 'POST':
+            payment = self._new_payment(data['amount'], description=data.get('description'), metadata=data.get('metadata'))
+            return 201, payment
+        if resource == 'payments' and size == 2 and http_method == 'GET':
+            return 200, self.payments[segments[1]]
+        if resource == 'payments' and size == 3 and segments[2] == 'refunds' and http_method == 'POST':
+            payment = self.payments[segments[1]]
+            refund = {
+                'resource': 'refund',
+                'id': self._new_id('re'),
+                'paymentId': payment['id'],
+                'amount': data['amount'],
+                'status': 'pending',
+                'createdAt': _mollie_now(),
+            }
+            self.refunds[refund['id']] = refund
+            return 201, refund
+        if resource == 'settlements' and http_method == 'GET':
+            if size == 1:
+                return 200, self._list('settlements', self.settlements, query, path)
+            settlement = next(settlement for settlement in self.settlements if settlement['id'] == segments[1])
+            if size == 2:
+                return 200, settlement
+            if segments[2] == 'payments':
+                return 200, self._list('payments', self.settlement_payments[settlement['id']], query, path)
+            if segments[2] == 'refunds':
+                return 200, self._list('refunds', self.settlement_refunds[settlement['id']], query, path)
+        raise KeyError(path)
+
+    def _create_order(self, data):
+        lines_total = Decimal(0)
+        for line in data.get('lines', []):
+            line_total = Decimal(line['totalAmount']['value'])
+            if Decimal(line['unitPrice']['value']) * line['quantity'] - Decimal(line.get('discountAmount', {}).get('value', 0)) != line_total:
+                return 422, self._error(422, 'Unprocessable Entity', 'The line total amount does not match the unit price and quantity.', 'lines')
+            lines_total += line_total
+        if lines_total != Decimal(data['amount']['value']):
+            return 422, self._error(422, 'Unprocessable Entity', 'The amount of the order does not match the total amount from the order lines.', 'amount')
+        order = {
+            'resource': 'order',
+            'id': self._new_id('ord'),
+            'mode': 'test',
+            'status': 'created',
+            'amount': data['amount'],
+            'orderNumber': data.get('orderNumber'),
+            'lines': data.get('lines', []),
+            'metadata': data.get('metadata'),
+            'createdAt': _mollie_now(),
+            'payment_ids': [],
+        }
+        order['_links'] = {'checkout': {'href': '%s/checkout/%s' % (self.url, order['id'])}}
+        payment = self._new_payment(order['amount'], order_id=order['id'])
+        order['payment_ids'].append(payment['id'])
+        self.orders[order['id']] = order
+        return 201, self._order_payload(order, embed_payments=False)
+
+    def _order_payload(self, order, embed_payments):
+        payload = {key: value for key, value in order.items() if key != 'payment_ids'}
+        if embed_payments:
+            payload['_embedded'] = {'payments': [self.payments[payment_id] for payment_id in order['payment_ids']]}
+        return payload
+
+    def _list(self, resource, records, query, path):
+        limit = min(int(query.get('limit') or self.page_size), MOLLIE_MAX_PAGE_SIZE)
+        start = 0
+        if query.get('from'):
+            positions = self._positions.get(id(records))
+            if not positions or len(positions) != len(records):
+                positions = self._positions[id(records)] = {record['id']: index for index, record in enumerate(records)}
+            start = positions[query['from']]
+        page = records[start:start + limit]
+        next_link = None
+        if start + limit < len(records):
+            next_link = {
+                'href': '%s%s?%s' % (self.url, path, urlencode({'from': records[start + limit]['id'], 'limit': limit})),
+                'type': 'application/hal+json',
+            }
+        return {'count': len(page), '_embedded': {resource: page}, '_links': {'next': next_link, 'previous': None}}
+
+    def _error(self, status, title, detail, field=None):
+        error = {'status': status, 'title': title, 'detail': detail}
+        if field:
+            error['field'] = field
+        return error
+
+
+def mollie_use_fake_server(env, server):
+    """ Send the mollie api calls of the database to given fake server
+
+        :return: mollie acquirer in test mode
+    """
+    env['ir.config_parameter'].sudo().set_param('payment_mollie_official.api_endpoint', server.url)
+    acquirer = env.ref('payment_mollie_official.payment_acquirer_mollie').sudo()
+    acquirer.write({'state': 'test', 'mollie_api_key_test': MOLLIE_TEST_API_KEY})
+    return acquirer
+
+
+class MollieFakeServerMixin(object):
+    """ Mixin of test cases whose mollie api calls are answered by a `MollieFakeServer` """
+    mollie_server_options = {}
+
+    @classmethod
+    def setUpClass(cls, *args, **kwargs):
+        super().setUpClass(*args, **kwargs)
+        cls.mollie_server = MollieFakeServer(**cls.mollie_server_options).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mollie_server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.acquirer = mollie_use_fake_server(self.env, self.mollie_server)
+
+
+class MollieInvoiceCommon(MollieFakeServerMixin, AccountTestInvoicingCommon):
+    """ Invoices paid with mollie through the fake server """
+
+    def _create_mollie_invoice(self, lines_count, **line_vals):
+        """ :return: customer invoice with `lines_count` product lines, prices tax included are exact
+                     so mollie accepts the invoice as an order
+        """
+        return self.env['account.move'].create({
+            'move_type': 'out_invoice',
+            'partner_id': self.partner_a.id,
+            'invoice_date': '2021-01-01',
+            'invoice_line_ids': [(0, 0, dict({
+                'product_id': self.product_a.id,
+                'name': 'Line %s' % index,
+                'quantity': 1 + index % 3,
+                'price_unit': 10 + index % 7,
+                'tax_ids': [(6, 0, self.tax_sale_a.ids)],
+            }, **line_vals)) for index in range(lines_count)],
+        })
+
+    def _create_mollie_transaction(self, invoice, amount=None, method='ideal'):
+        return self.env['payment.transaction'].sudo().create({
+            'acquirer_id': self.acquirer.id,
+            'reference': 'MOLLIE-%s' % invoice.id,
+            'amount': invoice.amount_total if amount is None else amount,
+            'currency_id': invoice.currency_id.id,
+            'partner_id': invoice.partner_id.id,
+            'invoice_ids': [(6, 0, invoice.ids)],
+            'mollie_payment_method': method,
+        })
+
+
+@contextmanager
+def mollie_benchmark(name, cr=None):
+    """ Log wall time, number of queries (of given cursor) and memory peak of the block.
+        The measures are also available in the yielded dict once the block is done.
+    """
+    result = {}
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    queries = cr.sql_log_count if cr else 0
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['duration'] = time.perf_counter() - start
+        result['queries'] = cr.sql_log_count - queries if cr else 0
+        result['memory_peak'] = tracemalloc.get_traced_memory()[1]
+        if not tracing:
+            tracemalloc.stop()
+        _logger.info("Mollie benchmark %s: %.2f s, %s queries, %.1f MiB peak",
+                     name, result['duration'], result['queries'], result['memory_peak'] / 1024 / 1024)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+
+from odoo.tests import tagged
+from odoo.tests.common import HttpCase
+
+from .common import MollieFakeServerMixin, MollieInvoiceCommon, mollie_benchmark
+
+ORDER_LINES = 1000
+WEBHOOK_COUNT = 100
+WEBHOOK_CONCURRENCY = 10
+
+
+@tagged('post_install', '-at_install', '-standard', 'mollie_benchmark')
+class TestMollieCheckoutBenchmark(MollieInvoiceCommon):
+    """ Checkout of big invoices, run with `--test-tags mollie_benchmark` """
+    mollie_server_options = {'latency': 0.05}
+
+    def test_checkout_big_order(self):
+        invoice = self._create_mollie_invoice(ORDER_LINES)
+        transaction = self._create_mollie_transaction(invoice)
+        self.env['account.move.line'].invalidate_cache()
+
+        with mollie_benchmark('checkout of a %s lines order' % ORDER_LINES, self.cr):
+            values = self.acquirer.mollie_form_generate_values({'reference': transaction.reference})
+
+        self.assertTrue(values['checkout_url'])
+        self.assertEqual(len(self.mollie_server.orders[transaction.acquirer_reference]['lines']), ORDER_LINES)
+
+
+@tagged('post_install', '-at_install', '-standard', 'mollie_benchmark')
+class TestMollieWebhookBenchmark(MollieFakeServerMixin, HttpCase):
+    """ Burst of webhooks (e.g. after a mollie incident), run with `--test-tags mollie_benchmark` """
+    mollie_server_options = {'latency': 0.05}
+
+    def test_concurrent_webhooks(self):
+        partner = self.env['res.partner'].create({'name': 'Mollie Customer'})
+        currency = self.env.ref('base.EUR')
+        transactions = self.env['payment.transaction'].sudo()
+        for index in range(WEBHOOK_COUNT):
+            order = self.mollie_server.add_order(10 + index, status='open')
+            transactions |= transactions.create({
+                'acquirer_id': self.acquirer.id,
+                'reference': 'MOLLIE-WEBHOOK-%s' % index,
+                'amount': 10 + index,
+                'currency_id': currency.id,
+                'partner_id': partner.id,
+                'acquirer_reference': order['id'],
+            })
+            self.mollie_server.set_status(order['id'], 'paid')
+        notifications = [{'tx': transaction.id, 'id': transaction.acquirer_reference} for transaction in transactions]
+
+        with mollie_benchmark('reception of %s concurrent webhooks' % WEBHOOK_COUNT, self.cr):
+            with ThreadPoolExecutor(max_workers=WEBHOOK_CONCURRENCY) as executor:
+                responses = list(executor.map(lambda data: self.url_open('/payment/mollie/notify', data=data), notifications))
+        self.assertEqual({(response.status_code, response.text) for response in responses}, {(200, 'ok')})
+
+        events = self.env['mollie.webhook.event'].search([('transaction_id', 'in', transactions.ids)])
+        self.assertEqual(len(events), WEBHOOK_COUNT)
+        with mollie_benchmark('processing of %s webhooks' % WEBHOOK_COUNT, self.cr):
+            events._cron_process_webhook_events()
+
+        self.assertEqual(set(events.mapped('state')), {'done'})
+        self.assertEqual(set(transactions.mapped('state')), {'done'})
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from odoo.addons.payment_mollie_official.models import mollie_api_metric
+
+from .common import MollieInvoiceCommon
+
+
+@tagged('post_install', '-at_install')
+class TestMollieCheckout(MollieInvoiceCommon):
+
+    def test_checkout_order_api(self):
+        invoice = self._create_mollie_invoice(5)
+        transaction = self._create_mollie_transaction(invoice)
+
+        values = self.acquirer.mollie_form_generate_values({'reference': transaction.reference})
+
+        order = self.mollie_server.orders[transaction.acquirer_reference]
+        self.assertEqual(values['checkout_url'], order['_links']['checkout']['href'])
+        self.assertEqual(len(order['lines']), 5)
+        self.assertEqual(self.mollie_server.count_requests('POST', '/v2/payments'), 0)
+
+    def test_checkout_payment_api(self):
+        """ Partially paid invoice does not match its lines, payment api is used directly """
+        invoice = self._create_mollie_invoice(5)
+        transaction = self._create_mollie_transaction(invoice, amount=invoice.amount_total / 2)
+        order_calls = self.mollie_server.count_requests('POST', '/v2/orders')
+
+        values = self.acquirer.mollie_form_generate_values({'reference': transaction.reference})
+
+        self.assertTrue(transaction.acquirer_reference.startswith('tr_'))
+        self.assertEqual(values['checkout_url'], self.mollie_server.payments[transaction.acquirer_reference]['_links']['checkout']['href'])
+        self.assertEqual(self.mollie_server.count_requests('POST', '/v2/orders'), order_calls)
+
+    def test_checkout_payment_only_method(self):
+        """ Order payload is not built for a method without order api """
+        self.env['mollie.payment.method'].create({
+            'name': 'Bank transfer',
+            'method_id_code': 'banktransfer',
+            'parent_id': self.acquirer.id,
+            'supports_payment_api': True,
+        })
+        invoice = self._create_mollie_invoice(5)
+        transaction = self._create_mollie_transaction(invoice, method='banktransfer')
+
+        with patch.object(type(self.acquirer), '_mollie_prepare_order_data') as prepare_order_data:
+            self.acquirer.mollie_form_generate_values({'reference': transaction.reference})
+
+        prepare_order_data.assert_not_called()
+        self.assertTrue(transaction.acquirer_reference.startswith('tr_'))
+
+    def test_checkout_prediction_metrics(self):
+        """ Api predictions are counted as events, out of the api calls and latencies """
+        invoice = self._create_mollie_invoice(5)
+        transaction = self._create_mollie_transaction(invoice, amount=invoice.amount_total / 2)
+
+        with patch.dict(mollie_api_metric._pending, clear=True), patch.object(mollie_api_metric, 'mollie_flush_metrics'):
+            self.acquirer.mollie_form_generate_values({'reference': transaction.reference})
+            predictions = [values for key, values in mollie_api_metric._pending.items() if key[1] == 'prediction.payment']
+
+        self.assertEqual(len(predictions), 1)
+        counters = dict(zip(mollie_api_metric.COUNTER_FIELDS, predictions[0]))
+        self.assertEqual(counters['event_count'], 1)
+        self.assertFalse(any(counters[field] for field in mollie_api_metric.COUNTER_FIELDS if field != 'event_count'))
+
+    def test_store_references_concurrent(self):
+        """ References stored meanwhile by another validation of the transaction are ignored """
+        invoice = self._create_mollie_invoice(1)
+        transaction = self._create_mollie_transaction(invoice)
+        order_data = {'resource': 'order', 'id': 'ord_test', '_embedded': {'payments': [{'resource': 'payment', 'id': 'tr_test'}]}}
+        self.assertFalse(transaction.mollie_reference_ids)
+        # Stored by the webhook, not in the cache of the customer return
+        self.env.cr.execute("INSERT INTO mollie_transaction_reference (name, transaction_id, reference_type) VALUES ('tr_test', %s, 'payment')", [transaction.id])
+
+        transaction._mollie_store_references(order_data)
+
+        self.assertEqual(sorted(transaction.mollie_reference_ids.mapped('name')), ['ord_test', 'tr_test'])
+        self.assertEqual(transaction.mollie_reference_ids.filtered(lambda r: r.name == 'ord_test').reference_type, 'order')
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import io
+from unittest.mock import patch
+
+from PIL import Image
+
+from odoo.tests import tagged
+from odoo.tests.common import SavepointCase
+
+from .common import MOLLIE_IDEAL_ISSUERS, MollieFakeServerMixin
+
+
+def _png(color):
+    output = io.BytesIO()
+    Image.new('RGB', (1, 1), color).save(output, 'PNG')
+    return output.getvalue()
+
+
+@tagged('post_install', '-at_install')
+class TestMollieMethodsSync(MollieFakeServerMixin, SavepointCase):
+    """ Query budgets of `_sync_mollie_methods` with the recorded methods of a test account.
+        Budgets must not depend on the number of methods or issuers.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.methods_data = self.acquirer._api_mollie_get_active_payment_methods()
+        self.assertEqual(len(self.methods_data), 6)
+
+    def _copy_methods(self, prefix):
+        """ Recorded methods with other codes, names and issuers """
+        methods_data = {}
+        for code, data in self.methods_data.items():
+            data = dict(data, id=prefix + code, description=prefix + data['description'])
+            if data.get('issuers'):
+                data['issuers'] = [dict(issuer, id=prefix + issuer['id'], name=prefix + issuer['name']) for issuer in data['issuers']]
+            methods_data[prefix + code] = data
+        return methods_data
+
+    def _create_icons(self, methods_data):
+        """ Icons already exist, like after the first sync, so no image is downloaded """
+        names = {method['description'] for method in methods_data.values()}
+        names |= {issuer['name'] for method in methods_data.values() for issuer in method.get('issuers') or []}
+        self.env['payment.icon'].create([{'name': name} for name in names])
+
+    def _sync(self, methods_data, acquirer=None):
+        self.env['mollie.payment.method'].invalidate_cache()
+        (acquirer or self.acquirer)._sync_mollie_methods(methods_data)
+
+    def _sync_queries(self, methods_data, acquirer):
+        """ :return: number of queries of a sync """
+        self.env['base'].flush()
+        start = self.cr.sql_log_count
+        self._sync(methods_data, acquirer)
+        self.env['base'].flush()
+        return self.cr.sql_log_count - start
+
+    def _change_methods(self, methods_data, prefix=''):
+        """ Remove bank transfer and change the minimum amount of iDEAL """
+        methods_data = dict(methods_data)
+        del methods_data[prefix + 'banktransfer']
+        methods_data[prefix + 'ideal'] = dict(methods_data[prefix + 'ideal'], minimumAmount={'value': '1.00', 'currency': 'EUR'})
+        return methods_data
+
+    def test_sync_methods(self):
+        self._create_icons(self.methods_data)
+        self._sync(self.methods_data)
+
+        methods = {method.method_id_code: method for method in self.acquirer.mollie_methods_ids}
+        self.assertEqual(set(methods), {'ideal', 'creditcard', 'bancontact', 'kbc', 'klarnapaylater', 'banktransfer'})
+        self.assertEqual(set(methods['ideal'].payment_issuer_ids.mapped('issuers_id_code')), {issuer_id for issuer_id, name in MOLLIE_IDEAL_ISSUERS})
+        self.assertEqual(methods['ideal'].payment_icon_ids.name, 'iDEAL')
+        self.assertTrue(methods['klarnapaylater'].supports_order_api)
+        self.assertFalse(methods['klarnapaylater'].supports_payment_api)
+        self.assertFalse(methods['banktransfer'].supports_order_api)
+        self.assertTrue(methods['banktransfer'].supports_payment_api)
+        self.assertEqual(methods['bancontact'].min_amount, 0.02)
+
+        self._sync(self._change_methods(self.methods_data))
+        self.assertFalse(methods['banktransfer'].active)
+        self.assertEqual(methods['ideal'].min_amount, 1.0)
+        self.assertTrue(methods['creditcard'].active)
+
+    def test_sync_methods_queries(self):
+        """ Syncs of an account with twice the methods and issuers are compared with the
+            recorded account: budgets are measured by the test, not hard coded.
+        """
+        acquirer, big_acquirer = self.acquirer, self.acquirer.copy()
+        methods_data = self.methods_data
+        big_methods_data = dict(self._copy_methods('a_'), **self._copy_methods('b_'))
+        self._create_icons(methods_data)
+        self._create_icons(big_methods_data)
+        records_count = len(methods_data) + len({issuer['id'] for method in methods_data.values() for issuer in method.get('issuers') or []})
+
+        # New methods and issuers are inserted one by one, anything else is done in batch
+        queries = self._sync_queries(methods_data, acquirer)
+        big_queries = self._sync_queries(big_methods_data, big_acquirer)
+        self.assertEqual(len(big_acquirer.mollie_methods_ids), 2 * len(methods_data))
+        self.assertLessEqual(big_queries - queries, records_count, "More than one query per created record")
+
+        # Nothing changed on mollie side: existing methods are only read
+        self.assertEqual(self._sync_queries(big_methods_data, big_acquirer), self._sync_queries(methods_data, acquirer))
+
+        # Changed and removed methods are written in one query per values
+        self.assertEqual(
+            self._sync_queries(self._change_methods(big_methods_data, 'a_'), big_acquirer),
+            self._sync_queries(self._change_methods(methods_data), acquirer),
+        )
+
+    def test_sync_methods_icons(self):
+        """ Every image is downloaded once and icons with the same image are shared """
+        self.env['payment.icon'].search([]).unlink()
+        colors = {}
+
+        def fetch_images(image_urls):
+            # KBC/CBC button and its issuers have the same image
+            return {url: _png((255, 0, 0) if 'kbc' in url or 'cbc' in url else (0, colors.setdefault(url, len(colors)), 0)) for url in image_urls}
+
+        with patch('odoo.addons.payment_mollie_official.models.payment_acquirer._mollie_fetch_images', side_effect=fetch_images) as fetch:
+            self._sync(self.methods_data)
+        self.assertEqual(fetch.call_count, 1)
+
+        methods = {method.method_id_code: method for method in self.acquirer.mollie_methods_ids}
+        kbc_issuers = methods['kbc'].payment_issuer_ids
+        self.assertEqual(len(kbc_issuers), 2)
+        self.assertEqual(len(kbc_issuers.mapped('payment_icon_ids') | methods['kbc'].payment_icon_ids), 1, "Same image should give one icon")
+        self.assertEqual(len(methods['ideal'].payment_issuer_ids.mapped('payment_icon_ids')), len(MOLLIE_IDEAL_ISSUERS))
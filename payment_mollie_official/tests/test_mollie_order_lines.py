@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from werkzeug import urls
+
+from odoo.tests import tagged
+
+from .common import MollieInvoiceCommon, mollie_benchmark
+
+ORDER_LINES = 1000
+
+
+def _legacy_invoice_lines(acquirer, invoice):
+    """ Lines of an invoice as built before the lines were prepared in batch """
+    result = []
+    for line in invoice.invoice_line_ids.filtered(lambda l: not l.display_type):
+        line_data = {
+            'name': line.name,
+            "type": "physical",
+        }
+        if line.product_id.type == 'service':
+            line_data['type'] = 'digital'
+        if 'is_delivery' in line._fields and line.is_delivery:
+            line_data['type'] = 'shipping_fee'
+        if line.product_id and 'website_url' in line.product_id._fields:
+            line_data['productUrl'] = urls.url_join(acquirer.get_base_url(), line.product_id.website_url)
+        line_data.update({
+            'quantity': int(line.quantity),
+            'unitPrice': {
+                'currency': line.always_set_currency_id.name,
+                'value': "%.2f" % (line.price_total / int(line.quantity))
+            },
+            'totalAmount': {
+                'currency': line.always_set_currency_id.name,
+                'value': "%.2f" % line.price_total,
+            },
+            'vatRate': "%.2f" % sum(line.tax_ids.mapped('amount')),
+            'vatAmount': {
+                'currency': line.always_set_currency_id.name,
+                'value': "%.2f" % (line.price_total - line.price_subtotal),
+            }
+        })
+        result.append(line_data)
+    return result
+
+
+@tagged('post_install', '-at_install')
+class TestMollieOrderLines(MollieInvoiceCommon):
+
+    def test_invoice_lines(self):
+        """ Batch builder gives the same lines as the line by line one """
+        service = self.env['product.product'].create({'name': 'Installation', 'type': 'service', 'lst_price': 80})
+        invoice = self.env['account.move'].create({
+            'move_type': 'out_invoice',
+            'partner_id': self.partner_a.id,
+            'invoice_date': '2021-01-01',
+            'invoice_line_ids': [
+                (0, 0, {'display_type': 'line_section', 'name': 'Products'}),
+                (0, 0, {'product_id': self.product_a.id, 'quantity': 3, 'price_unit': 12.5, 'tax_ids': [(6, 0, self.tax_sale_a.ids)]}),
+                (0, 0, {'product_id': self.product_b.id, 'quantity': 2, 'price_unit': 40, 'discount': 10,
+                        'tax_ids': [(6, 0, (self.tax_sale_a | self.tax_sale_b).ids)]}),
+                (0, 0, {'display_type': 'line_note', 'name': 'Delivered on monday'}),
+                (0, 0, {'product_id': service.id, 'quantity': 1, 'price_unit': 80, 'tax_ids': [(6, 0, self.tax_sale_b.ids)]}),
+                (0, 0, {'name': 'Without product', 'quantity': 1, 'price_unit': 5, 'tax_ids': []}),
+            ],
+        })
+        expected_lines = _legacy_invoice_lines(self.acquirer, invoice)
+        self.env['account.move.line'].invalidate_cache()
+
+        lines = self.acquirer._mollie_get_order_lines(invoice)
+
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines, expected_lines)
+        self.assertEqual([line['type'] for line in lines], ['physical', 'physical', 'digital', 'physical'])
+
+
+@tagged('post_install', '-at_install', '-standard', 'mollie_benchmark')
+class TestMollieOrderLinesBenchmark(MollieInvoiceCommon):
+    """ Order lines of a big invoice, run with `--test-tags mollie_benchmark` """
+
+    def test_invoice_lines_big_order(self):
+        invoice = self._create_mollie_invoice(ORDER_LINES)
+
+        self.env['account.move.line'].invalidate_cache()
+        with mollie_benchmark('legacy builder of %s lines' % ORDER_LINES, self.cr) as legacy:
+            expected_lines = _legacy_invoice_lines(self.acquirer, invoice)
+
+        self.env['account.move.line'].invalidate_cache()
+        with mollie_benchmark('builder of %s lines' % ORDER_LINES, self.cr) as batch:
+            lines = self.acquirer._mollie_get_order_lines(invoice)
+
+        self.assertEqual(lines, expected_lines)
+        self.assertLessEqual(batch['queries'], legacy['queries'])
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from datetime import datetime
+from decimal import Decimal
+
+from odoo.tests import tagged
+from odoo.tests.common import BaseCase
+
+from odoo.addons.payment_mollie_official.models.mollie_records import (
+    MolliePayment, MollieRefund, decode_mollie_payments, decode_mollie_refunds, mollie_payment_ref,
+    parse_mollie_amount, parse_mollie_datetime)
+
+from .common import mollie_benchmark
+
+_logger = logging.getLogger(__name__)
+
+DECODED_RECORDS = 100000
+
+
+def _legacy_decode_payment(payment):
+    """ Values of a payment as decoded line by line before the records layer """
+    metadata = payment['metadata'] or {}
+    ref = ""
+    if metadata.get('customer'):
+        if metadata['customer'].get('firstName'):
+            ref += metadata['customer']['firstName']
+        if metadata['customer'].get('lastName'):
+            if ref:
+                ref += ' '
+            ref += metadata['customer']['lastName']
+    if metadata.get('reference'):
+        ref += ' #' if ref else '#'
+        ref += metadata['reference']
+    return {
+        'date': datetime.strftime(datetime.strptime(payment['createdAt'], "%Y-%m-%dT%H:%M:%S+00:00"), '%Y-%m-%d'),
+        'name': ref or payment['description'],
+        'amount': float(payment['settlementAmount']['value']),
+    }
+
+
+def _payment_data(index):
+    return {
+        'resource': 'payment',
+        'id': 'tr_%s' % index,
+        'orderId': 'ord_%s' % index,
+        'status': 'paid',
+        'createdAt': '2021-03-01T10:%02d:%02d+00:00' % (index // 60 % 60, index % 60),
+        'amount': {'value': '10.25', 'currency': 'EUR'},
+        'settlementAmount': {'value': '10.25', 'currency': 'EUR'},
+        'description': 'Order %s' % index,
+        'metadata': {'reference': 'S%05d' % index},
+    }
+
+
+class TestMollieRecords(BaseCase):
+
+    def test_parse_datetime(self):
+        expected = datetime(2021, 3, 1, 10, 0)
+        self.assertEqual(parse_mollie_datetime('2021-03-01T10:00:00+00:00'), expected)
+        self.assertEqual(parse_mollie_datetime('2021-03-01T10:00:00Z'), expected)
+        self.assertEqual(parse_mollie_datetime('2021-03-01'), datetime(2021, 3, 1))
+        self.assertIsNone(parse_mollie_datetime(None))
+        self.assertIsNone(parse_mollie_datetime(''))
+
+    def test_parse_datetime_fractional_seconds(self):
+        self.assertEqual(parse_mollie_datetime('2021-03-01T10:00:00.123456Z'), datetime(2021, 3, 1, 10, 0, 0, 123456))
+        self.assertEqual(parse_mollie_datetime('2021-03-01T10:00:00.123Z'), datetime(2021, 3, 1, 10, 0, 0, 123000))
+        # Not an isoformat of python < 3.11, parsed by dateutil
+        self.assertEqual(parse_mollie_datetime('2021-03-01T10:00:00.0Z'), datetime(2021, 3, 1, 10, 0))
+        self.assertEqual(parse_mollie_datetime('2021-03-01T12:00:00.5+02:00'), datetime(2021, 3, 1, 10, 0, 0, 500000))
+
+    def test_parse_datetime_offset(self):
+        """ Dates are converted to naive UTC, the day may change """
+        self.assertEqual(parse_mollie_datetime('2021-03-01T12:00:00+02:00'), datetime(2021, 3, 1, 10, 0))
+        self.assertEqual(parse_mollie_datetime('2021-03-01T05:00:00-05:00'), datetime(2021, 3, 1, 10, 0))
+        self.assertEqual(parse_mollie_datetime('2021-03-01T00:30:00+01:00'), datetime(2021, 2, 28, 23, 30))
+        self.assertIsNone(parse_mollie_datetime('2021-03-01T12:00:00+02:00').tzinfo)
+
+    def test_parse_amount(self):
+        self.assertEqual(parse_mollie_amount({'value': '10.10', 'currency': 'EUR'}), Decimal('10.10'))
+        self.assertEqual(parse_mollie_amount({'value': '-0.29', 'currency': 'EUR'}), Decimal('-0.29'))
+        self.assertIsNone(parse_mollie_amount(None))
+
+    def test_payment_ref(self):
+        self.assertEqual(mollie_payment_ref({'customer': {'firstName': 'Jane', 'lastName': 'Doe'}, 'reference': 'S0001'}), 'Jane Doe #S0001')
+        self.assertEqual(mollie_payment_ref({'customer': {'firstName': 'Jane'}}), 'Jane')
+        self.assertEqual(mollie_payment_ref({'reference': 'S0001'}), '#S0001')
+        self.assertEqual(mollie_payment_ref(None), '')
+
+    def test_decode_records(self):
+        payment = next(decode_mollie_payments([_payment_data(1)]))
+        self.assertEqual(payment.id, 'tr_1')
+        self.assertEqual(payment.order_id, 'ord_1')
+        self.assertEqual(payment.created_at, datetime(2021, 3, 1, 10, 0, 1))
+        self.assertEqual(payment.amount, Decimal('10.25'))
+        self.assertEqual(payment.currency, 'EUR')
+        self.assertEqual(payment.reference, '#S00001')
+        # Decoded records are passed through
+        self.assertIs(next(decode_mollie_payments([payment])), payment)
+
+        refund = next(decode_mollie_refunds([{
+            'id': 're_1',
+            'paymentId': 'tr_1',
+            'createdAt': '2021-03-02T10:00:00.0Z',
+            'settlementAmount': {'value': '-5.00', 'currency': 'EUR'},
+            'description': 'Refund',
+        }]))
+        self.assertIsInstance(refund, MollieRefund)
+        self.assertEqual(refund.settlement_amount, Decimal('-5.00'))
+        self.assertEqual(refund.created_at, datetime(2021, 3, 2, 10, 0))
+        self.assertEqual(refund.reference, '')
+
+
+@tagged('-standard', 'mollie_benchmark')
+class TestMollieRecordsBenchmark(BaseCase):
+    """ Decoding of the records of a big settlement, run with `--test-tags mollie_benchmark` """
+
+    def test_decode_payments(self):
+        """ Typed records against the line by line decoding they replace, on the same payload """
+        records = [_payment_data(index) for index in range(DECODED_RECORDS)]
+
+        with mollie_benchmark('legacy decoding of %s payments' % DECODED_RECORDS) as legacy:
+            legacy_payments = [_legacy_decode_payment(record) for record in records]
+
+        with mollie_benchmark('decoding of %s payments' % DECODED_RECORDS) as decoding:
+            payments = list(decode_mollie_payments(records))
+
+        _logger.info('Mollie records decoding is %.1f times faster than line by line decoding', legacy['duration'] / decoding['duration'])
+        self.assertEqual(len(payments), DECODED_RECORDS)
+        self.assertTrue(all(isinstance(payment, MolliePayment) for payment in payments))
+        self.assertEqual(sum(payment.settlement_amount for payment in payments), Decimal('10.25') * DECODED_RECORDS)
+        self.assertEqual(
+            [(payment.created_at.strftime('%Y-%m-%d'), payment.reference, float(payment.settlement_amount)) for payment in payments[:100]],
+            [(payment['date'], payment['name'], payment['amount']) for payment in legacy_payments[:100]],
+        )
+        self.assertLess(decoding['duration'], legacy['duration'])
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import tagged
+from odoo.tests.common import SavepointCase
+
+from odoo.addons.payment_mollie_official.models.mollie_webhook_event import MAX_ATTEMPTS, RETRY_DELAYS
+
+from .common import MollieFakeServerMixin
+
+
+@tagged('post_install', '-at_install')
+class TestMollieWebhookEvents(MollieFakeServerMixin, SavepointCase):
+
+    def setUp(self):
+        super().setUp()
+        order = self.mollie_server.add_order(10, status='paid')
+        self.transaction = self.env['payment.transaction'].sudo().create({
+            'acquirer_id': self.acquirer.id,
+            'reference': 'MOLLIE-WEBHOOK',
+            'amount': 10,
+            'currency_id': self.env.ref('base.EUR').id,
+            'partner_id': self.env['res.partner'].create({'name': 'Mollie Customer'}).id,
+            'acquirer_reference': order['id'],
+        })
+        self.event = self.env['mollie.webhook.event'].create({
+            'transaction_id': self.transaction.id,
+            'mollie_reference': order['id'],
+        })
+
+    def test_retry_failed_event(self):
+        """ Failing events are rescheduled with a growing delay, then dropped after the last attempt """
+        with patch.object(type(self.acquirer), '_mollie_get_payment_data', side_effect=Exception('Read timed out')) as get_payment_data:
+            for attempt in range(1, MAX_ATTEMPTS):
+                self.event._cron_process_webhook_events()
+                self.assertEqual(self.event.state, 'pending')
+                self.assertEqual(self.event.attempt_count, attempt)
+                self.assertEqual(self.event.error_msg, 'Read timed out')
+                delay = timedelta(minutes=RETRY_DELAYS[min(attempt, len(RETRY_DELAYS)) - 1])
+                self.assertAlmostEqual(self.event.next_attempt_at, self.event.processed_at + delay, delta=timedelta(seconds=1))
+
+                # Not retried before its next attempt
+                self.event._cron_process_webhook_events()
+                self.assertEqual(self.event.attempt_count, attempt)
+                self.event.next_attempt_at = fields.Datetime.now() - timedelta(seconds=1)
+
+            self.event._cron_process_webhook_events()
+
+        self.assertEqual(get_payment_data.call_count, MAX_ATTEMPTS)
+        self.assertEqual(self.event.state, 'error')
+        self.assertEqual(self.event.attempt_count, MAX_ATTEMPTS)
+        self.assertFalse(self.event.next_attempt_at)
+        self.assertEqual(self.transaction.state, 'draft')
+
+        # Retried from scratch on demand
+        self.event.action_retry()
+        self.event._cron_process_webhook_events()
+        self.assertEqual(self.event.state, 'done')
+        self.assertEqual(self.event.attempt_count, 1)
+        self.assertEqual(self.transaction.state, 'done')
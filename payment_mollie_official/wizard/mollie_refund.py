@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from odoo import _, fields, models
+from odoo.exceptions import UserError
+
+from odoo.addons.payment_mollie_official.models.mollie_api_metric import mollie_api_caller
+from odoo.addons.payment_mollie_official.models.payment_acquirer import MollieRateLimiter, _mollie_create_refund
+
+_logger = logging.getLogger(__name__)
+
+REFUND_WORKERS = 4
+REFUND_RATE = 10    # API calls per second
+
+
+class MollieRefund(models.TransientModel):
+    _name = 'wiz.mollie.refund'
+    _description = 'Mollie mass refund wizard'
+
+    def _default_move_ids(self):
+        if self.env.context.get('active_model') == 'account.move':
+            return self.env['account.move'].browse(self.env.context.get('active_ids', []))
+        return self.env['account.move']
+
+    move_ids = fields.Many2many('account.move', string="Credit Notes", default=_default_move_ids)
+    line_ids = fields.One2many('wiz.mollie.refund.line', 'wiz_id', string="Result")
+    state = fields.Selection([('draft', 'Draft'), ('done', 'Done')], default='draft')
+
+    def action_refund(self):
+        """ Refund the credit notes in mollie concurrently, then register the payments of
+            the refunded credit notes grouped by journal.
+        """
+        self.ensure_one()
+        moves = self.move_ids
+        if not moves:
+            raise UserError(_("Please select the credit notes to refund."))
+        transactions_by_move = moves._get_valid_mollie_transactions()
+        results = {}
+        to_refund = []
+        for move in moves:
+            transactions = transactions_by_move.get(move.id)
+            if move.mollie_refund_reference:
+                results[move.id] = ('skipped', _("Already refunded in mollie"))
+            elif not move.valid_for_mollie_refund or not transactions:
+                results[move.id] = ('skipped', _("No done mollie transaction to refund"))
+            elif len(transactions) > 1:
+                results[move.id] = ('skipped', _("Multiple mollie transactions are linked with invoice. Please refund manually from mollie portal"))
+            else:
+                to_refund.append((move, transactions))
+
+        refunds = self._mollie_create_refunds(to_refund)
+
+        refunded_moves = self.env['account.move']
+        for move, transactions in to_refund:
+            refund, error = refunds[move.id]
+            if error:
+                results[move.id] = ('failed', error)
+                continue
+            refunded_moves |= move
+            results[move.id] = ('refunded', refund['id'])
+            # Mollie refunds are usually pending at creation, the reference is what prevents a second refund
+            move.mollie_refund_reference = refund['id']
+
+        # Refunds are already done in mollie, so a failing payment registration is only reported
+        for payment_method, group_moves in self._mollie_group_moves_by_payment_method(refunded_moves, transactions_by_move).items():
+            journal, method = payment_method
+            try:
+                with self.env.cr.savepoint():
+                    self.env['account.payment.register'].with_context(active_ids=group_moves.ids, active_model='account.move').create({
+                        'journal_id': journal.id,
+                        'payment_method_id': method.id,
+                        'group_payment': False,
+                    }).action_create_payments()
+            except Exception as e:
+                _logger.exception("Mollie: can not register refund payments")
+                for move in group_moves:
+                    results[move.id] = ('failed', _("Refunded in mollie (%s) but payment is not registered: %s") % (results[move.id][1], e))
+
+        self.write({
+            'state': 'done',
+            'line_ids': [(5, 0, 0)] + [(0, 0, {
+                'move_id': move.id,
+                'state': results[move.id][0],
+                'message': results[move.id][1],
+            }) for move in moves],
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _mollie_create_refunds(self, moves_transactions):
+        """ Call mollie refund api on a thread pool. Clients and amounts are prepared here
+            as the threads can not use the ORM.
+
+            :param moves_transactions: list of (move, transaction)
+            :return: dict of move id and tuple of (refund, error message)
+        """
+        if not moves_transactions:
+            return {}
+        clients = {}
+        refund_args = []
+        for move, transaction in moves_transactions:
+            acquirer = transaction.acquirer_id
+            if acquirer not in clients:
+                clients[acquirer] = acquirer._api_mollie_get_client()
+            refund_args.append((clients[acquirer], transaction.acquirer_reference, move.amount_total, move.currency_id.name))
+
+        rate_limiter = MollieRateLimiter(REFUND_RATE)
+
+        def create_refund(args):
+            try:
+                with mollie_api_caller('mass_refund'):
+                    return _mollie_create_refund(*args, rate_limiter=rate_limiter), False
+            except Exception as e:
+                _logger.warning("Mollie: refund of %s failed: %s", args[1], e)
+                return False, str(e)
+
+        with ThreadPoolExecutor(max_workers=min(REFUND_WORKERS, len(refund_args))) as executor:
+            refunds = list(executor.map(create_refund, refund_args))
+        return {move.id: refund for (move, transaction), refund in zip(moves_transactions, refunds)}
+
+    def _mollie_group_moves_by_payment_method(self, moves, transactions_by_move):
+        """ :return: dict of (journal, payment method) of the original payment and its moves """
+        result = {}
+        for move in moves:
+            payment = transactions_by_move[move.id].payment_id
+            key = (payment.journal_id, payment.payment_method_id)
+            result.setdefault(key, self.env['account.move'])
+            result[key] |= move
+        return result
+
+
+class MollieRefundLine(models.TransientModel):
+    _name = 'wiz.mollie.refund.line'
+    _description = 'Mollie mass refund result'
+
+    wiz_id = fields.Many2one('wiz.mollie.refund')
+    move_id = fields.Many2one('account.move', string="Credit Note")
+    partner_id = fields.Many2one(related='move_id.partner_id')
+    amount_total = fields.Monetary(related='move_id.amount_total')
+    currency_id = fields.Many2one(related='move_id.currency_id')
+    state = fields.Selection([
+        ('refunded', 'Refunded'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed')
+    ])
+    message = fields.Char()